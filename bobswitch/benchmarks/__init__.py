@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+    Benchmarks
+    ~~~~~~~~~~~~
+
+    Micro benchmarks for the engine and conversion hot paths.  Benchmark 
+    functions are registered with the ``benchmark`` decorator, take the 
+    number of iterations to run and return the seconds spent in the code 
+    being measured so setup can be left out of the timing.
+"""
+
+import timeit
+
+timer = timeit.default_timer
+
+BENCHMARKS = []
+
+def benchmark(name, iterations=10000):
+    """Benchmark registration decorator::
+
+        @benchmark("foo", iterations=1000)
+        def foo(iterations):
+            start = timer()
+            ...
+            return timer() - start
+    """
+    def register(f):
+        BENCHMARKS.append((name, iterations, f))
+        return f
+
+    return register
+
+
+def run_benchmark(name, iterations, f, repeat=5):
+    """
+    Runs a benchmark repeat times and returns a dict of the per 
+    iteration timings in seconds
+    """
+    timings = [f(iterations) / iterations for _ in xrange(repeat)]
+
+    return {
+        "name": name,
+        "iterations": iterations,
+        "repeat": repeat,
+        "best": min(timings),
+        "mean": sum(timings) / len(timings)
+    }
+
+
+def run_benchmarks(names=None, repeat=5, scale=1.0):
+    """
+    Runs every registered benchmark, or just those named, scale multiplies
+    the number of iterations of each
+    """
+    return [run_benchmark(name, max(1, int(iterations * scale)), f, repeat)
+            for name, iterations, f in BENCHMARKS
+            if not names or name in names]
+
+
+def compare_results(results, baseline, threshold=1.25):
+    """
+    Returns a list of (name, ratio) for each benchmark whose best time is
+    more than threshold times slower than the baseline results
+    """
+    baseline_best = dict((result["name"], result["best"]) for result in baseline)
+
+    regressions = []
+    for result in results:
+        previous = baseline_best.get(result["name"])
+        if previous and result["best"] / previous > threshold:
+            regressions.append((result["name"], result["best"] / previous))
+
+    return regressions
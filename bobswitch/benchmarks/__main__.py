@@ -0,0 +1,58 @@
+import sys
+import json
+import platform
+import argparse
+
+from bobswitch.benchmarks import run_benchmarks, compare_results
+from bobswitch.benchmarks import bench_engine, bench_json_convert, bench_snapshot
+
+
+def parse_args(argv=sys.argv[1:]):
+    description = """
+    Run the bobswitch micro benchmarks and write the results as json
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("names", nargs="*", help="only run these benchmarks")
+    parser.add_argument("-o", "--output", help="write results to this file")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                    help="number of times to repeat each benchmark")
+    parser.add_argument("-s", "--scale", type=float, default=1.0,
+                    help="multiplier for the number of iterations")
+    parser.add_argument("-c", "--compare", 
+                    help="previous results file to check for regressions")
+    parser.add_argument("-t", "--threshold", type=float, default=1.25,
+                    help="slowdown ratio counted as a regression")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+
+    results = run_benchmarks(arguments.names, arguments.repeat, 
+            arguments.scale)
+    for result in results:
+        sys.stderr.write("%-24s %12.3f us\n" % 
+                (result["name"], result["best"] * 1e6))
+
+    output = json.dumps({
+        "python": platform.python_version(),
+        "results": results
+    }, indent=4, sort_keys=True)
+
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            f.write(output)
+    else:
+        print output
+
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            baseline = json.load(f)["results"]
+
+        regressions = compare_results(results, baseline, arguments.threshold)
+        for name, ratio in regressions:
+            sys.stderr.write("regression: %s is %.2fx slower\n" % (name, ratio))
+
+        if regressions:
+            sys.exit(1)
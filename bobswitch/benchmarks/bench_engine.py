@@ -0,0 +1,128 @@
+from bobswitch import engine
+from bobswitch import models
+from bobswitch.models import Card, Suit, Rank
+from bobswitch.benchmarks import benchmark, timer
+
+
+def create_hand(cards):
+    hand = models.Hand()
+    hand.add_cards([Card(suit, rank) for suit, rank in cards])
+
+    return hand
+
+
+LARGE_HAND = [(suit, rank) for suit in (Suit.hearts, Suit.spades)
+        for rank in (Rank.three, Rank.five, Rank.six, Rank.nine, Rank.ten, 
+            Rank.queen, Rank.king)]
+
+
+def record_game(seed, number_of_players=3):
+    """
+    Plays a seeded game taking the first legal move each turn and returns
+    the list of (player name, move) played
+    """
+    game = create_game(seed, number_of_players)
+
+    moves = []
+    while game.state is not engine.GameState.FINISHED and len(moves) < 1000:
+        player_name = game.players[game.current_player - 1].name
+        move = game.legal_moves(player_name)[0]
+        if (move.move_type is engine.MoveType.play 
+                and move.card.rank_id == engine.ACE):
+            move = engine.GameMove(move.move_type, move.card, Suit.hearts)
+        game.play(player_name, move)
+        moves.append((player_name, move))
+
+    return moves
+
+
+def create_game(seed, number_of_players=3):
+    players = [models.Player("bot%d" % (seat,)) 
+            for seat in xrange(number_of_players)]
+    deck = engine.create_deck(seed)
+    deck.shuffle()
+
+    return engine.Game(players, 7, deck)
+
+
+@benchmark("card_construction", iterations=100000)
+def card_construction(iterations):
+    suit = Suit.diamonds
+    rank = Rank.queen
+
+    start = timer()
+    for _ in xrange(iterations):
+        Card(suit, rank)
+    return timer() - start
+
+
+@benchmark("hand_contains_card", iterations=100000)
+def hand_contains_card(iterations):
+    hand = create_hand(LARGE_HAND)
+    card = Card(Suit.clubs, Rank.king)
+
+    start = timer()
+    for _ in xrange(iterations):
+        hand.contains_card(card)
+    return timer() - start
+
+
+@benchmark("valid_play", iterations=100000)
+def valid_play(iterations):
+    hand = create_hand(LARGE_HAND)
+    card = Card(Suit.spades, Rank.king)
+    top_card = Card(Suit.clubs, Rank.king)
+    state = engine.GameState.NORMAL
+
+    start = timer()
+    for _ in xrange(iterations):
+        engine.valid_play(card, hand, top_card, state)
+    return timer() - start
+
+
+@benchmark("valid_pick", iterations=100000)
+def valid_pick(iterations):
+    hand = create_hand(LARGE_HAND)
+    top_card = Card(Suit.clubs, Rank.seven)
+    state = engine.GameState.NORMAL
+
+    start = timer()
+    for _ in xrange(iterations):
+        engine.valid_pick(hand, top_card, state)
+    return timer() - start
+
+
+@benchmark("game_play", iterations=20000)
+def game_play(iterations):
+    """
+    Replays recorded games move by move, only the play calls are timed
+    """
+    recorded = [(seed, record_game(seed)) for seed in xrange(10)]
+
+    elapsed = 0.0
+    played = 0
+    while played < iterations:
+        for seed, moves in recorded:
+            moves = moves[:iterations - played]
+            game = create_game(seed)
+
+            start = timer()
+            for player_name, move in moves:
+                game.play(player_name, move)
+            elapsed = elapsed + timer() - start
+
+            played = played + len(moves)
+            if played >= iterations:
+                break
+
+    return elapsed
+
+
+@benchmark("game_status", iterations=100000)
+def game_status(iterations):
+    game = create_game(1, 4)
+
+    start = timer()
+    for _ in xrange(iterations):
+        game.status()
+    return timer() - start
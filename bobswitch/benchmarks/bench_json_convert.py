@@ -0,0 +1,61 @@
+from bobswitch import engine
+from bobswitch import json_convert
+from bobswitch.benchmarks import benchmark, timer
+from bobswitch.benchmarks.bench_engine import create_game
+
+
+@benchmark("convert_card", iterations=100000)
+def convert_card(iterations):
+    game = create_game(1)
+    card = game.played_cards.top_card
+
+    start = timer()
+    for _ in xrange(iterations):
+        json_convert.convert_card(card)
+    return timer() - start
+
+
+@benchmark("convert_hand", iterations=50000)
+def convert_hand(iterations):
+    game = create_game(1)
+    hand = game.player_hand("bot0")
+
+    start = timer()
+    for _ in xrange(iterations):
+        json_convert.convert_hand(hand)
+    return timer() - start
+
+
+@benchmark("convert_state_start", iterations=20000)
+def convert_state_start(iterations):
+    game = create_game(1, 4)
+    hand = game.player_hand("bot0")
+    top_card = game.played_cards.top_card
+
+    start = timer()
+    for _ in xrange(iterations):
+        json_convert.convert_state_start(game.state, game.players, 
+                game.player_hands, game.current_player, top_card, hand)
+    return timer() - start
+
+
+@benchmark("convert_state_watch", iterations=20000)
+def convert_state_watch(iterations):
+    game = create_game(1, 4)
+    top_card = game.played_cards.top_card
+
+    start = timer()
+    for _ in xrange(iterations):
+        json_convert.convert_state_watch(game.state, game.players, 
+                game.player_hands, game.current_player, top_card)
+    return timer() - start
+
+
+@benchmark("convert_play_response", iterations=100000)
+def convert_play_response(iterations):
+    play_response = engine.invalid_play_response("Not a valid move")
+
+    start = timer()
+    for _ in xrange(iterations):
+        json_convert.convert_play_response(play_response)
+    return timer() - start
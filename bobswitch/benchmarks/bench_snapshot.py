@@ -0,0 +1,35 @@
+import pickle
+
+from bobswitch import snapshot
+from bobswitch.benchmarks import benchmark, timer
+from bobswitch.benchmarks.bench_engine import create_game
+
+
+@benchmark("dump_game", iterations=20000)
+def dump_game(iterations):
+    game = create_game(1, 4)
+
+    start = timer()
+    for _ in xrange(iterations):
+        snapshot.dump_game(game)
+    return timer() - start
+
+
+@benchmark("load_game", iterations=20000)
+def load_game(iterations):
+    data = snapshot.dump_game(create_game(1, 4))
+
+    start = timer()
+    for _ in xrange(iterations):
+        snapshot.load_game(data)
+    return timer() - start
+
+
+@benchmark("pickle_game", iterations=5000)
+def pickle_game(iterations):
+    game = create_game(1, 4)
+
+    start = timer()
+    for _ in xrange(iterations):
+        pickle.loads(pickle.dumps(game, pickle.HIGHEST_PROTOCOL))
+    return timer() - start
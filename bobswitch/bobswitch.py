@@ -12,16 +12,25 @@
 """
 
 import sys
+import time
+import struct
 import argparse
 
 import tornado.ioloop
+import tornado.process
 import sockjs.tornado
 
-from json_convert import convert_hand, convert_state_start, convert_play_response, \
-        convert_state_watch
+import config
+
+from json_convert import convert_play_response, compact_play_response, \
+        convert_state_delta, StateSnapshot
 from engine import create_deck, Game, MoveType, GameMove, GameState
-from models import Player, Card, Suit, Rank
+from models import Player, SUITS, get_card
 from sockjs_ext import EventSocketConnection, event
+from sharding import Shard, ShardRouterHandler, ShardProxyConnection, \
+        front_application
+from store import RoomStore, SqliteRoomStore, decode_room
+from movelog import MoveLog
 
 import logging
 log = logging.getLogger()
@@ -32,11 +41,11 @@ def wrap_chat_message(name, message):
         "text": message
     }
 
-def create_game(players):
-    deck = create_deck()
+def create_game(players, seed=None):
+    deck = create_deck(seed)
     deck.shuffle()
     
-    game = Game(players, 7, deck)
+    game = Game(players, config.STARTING_CARDS, deck)
 
     return game
 
@@ -48,21 +57,74 @@ def convert_move_type(move_type):
     
     return MoveType.wait
 
-def convert_card(rankId, suitId):
-    rank = next(x for x in Rank if int(x) == rankId)
-    suit = next(x for x in Suit if int(x) == suitId)
+def parse_id(value, low, high):
+    if isinstance(value, bool) or not isinstance(value, (int, long)):
+        raise TypeError("expected an integer id not %r" % (value,))
+    if not low <= value <= high:
+        raise ValueError("id %r out of range" % (value,))
+
+    return value
 
-    return Card(suit, rank)
+def convert_card(rankId, suitId):
+    """
+    Returns the card for the ids, raises ValueError or TypeError if they 
+    aren't a rank id from 1 to 13 and a suit id from 0 to 3
+    """
+    return get_card(parse_id(suitId, 0, 3), parse_id(rankId, 1, 13))
 
 def convert_suit(suitId):
-    return next(x for x in Suit if int(x) == suitId)
+    """
+    Returns the suit for the id, raises ValueError or TypeError if it isn't
+    a suit id from 0 to 3
+    """
+    return SUITS[parse_id(suitId, 0, 3)]
+
+def parse_move(message):
+    """
+    Converts a game:player:move message to a GameMove, raises ValueError, 
+    TypeError or KeyError if it isn't a valid move.  Message format::
+
+        {
+            "type": "play",
+            "card": { rank: 4, suit: 4 },
+            "suit": 2
+        }
+    """
+    move_type = message["type"]
+    if move_type not in ("pick", "play", "wait"):
+        raise ValueError("unknown move type %r" % (move_type,))
+
+    move_type = convert_move_type(move_type)
+    if move_type is not MoveType.play:
+        return GameMove(move_type)
+
+    card = message["card"]
+    move = GameMove(MoveType.play, convert_card(card["rank"], card["suit"]))
+    if message.get("suit") is not None:
+        move.suit = convert_suit(message["suit"])
+
+    return move
 
 class Room(object):
-    def __init__(self):
+    def __init__(self, name=None):
+        self.name = name
         self.active_game = None
         self.active_players = {}
         self.players = {}
         self.participants = set()
+        self.snapshot = None
+
+        #time the last participant left, None while anyone is in the room
+        self.idle_since = None
+
+    def state_snapshot(self):
+        """
+        Returns the cached state snapshot for the active game
+        """
+        if self.snapshot is None or self.snapshot.game is not self.active_game:
+            self.snapshot = StateSnapshot(self.active_game)
+
+        return self.snapshot
     
 class RoomPlayer(object):
     def __init__(self, name, socket, player):
@@ -71,6 +133,54 @@ class RoomPlayer(object):
         self.player = player
         self.ready = False
 
+        #time the socket was lost, None while connected
+        self.disconnected_since = None
+
+def game_log_id(room_name, game):
+    return "%s:%s" % (room_name, game.seed)
+
+def restore_room(name, data, move_log=None):
+    """
+    Rebuilds a room saved in a room store, all the players are disconnected
+    until they log in again
+    """
+    record = decode_room(data)
+    room = Room(name)
+    room.idle_since = time.time()
+
+    for player_name, player, ready in record["players"]:
+        room_player = RoomPlayer(player_name, None, player)
+        room_player.ready = ready
+        room_player.disconnected_since = room.idle_since
+        room.players[player_name] = room_player
+
+    room.active_game = record["game"]
+    if room.active_game is not None:
+        room.active_players = dict((player_name, room.players[player_name])
+                for player_name in record["active_players"])
+        if move_log is not None:
+            move_log.restore_game(game_log_id(name, room.active_game), 
+                    room.active_game)
+
+    return room
+
+def load_rooms(store, shard=None, move_log=None):
+    """
+    Returns the rooms saved in the store, only those the shard owns if given.
+    Rooms that can't be restored are logged and left out
+    """
+    rooms = {}
+    for name, data in store.load_rooms().items():
+        if shard is not None and not shard.owns(name):
+            continue
+
+        try:
+            rooms[name] = restore_room(name, data, move_log)
+        except (ValueError, KeyError, IndexError, struct.error):
+            log.exception("failed to restore room %s", name)
+
+    return rooms
+
 
 class SocketConnection(EventSocketConnection):
     participants = set()
@@ -78,30 +188,106 @@ class SocketConnection(EventSocketConnection):
 
     rooms = {}
 
+    #set when running as one of several workers
+    shard = None
+
+    #set when workers run without a front process, listings for rooms this
+    #worker doesn't own are answered with room:redirect
+    redirect = False
+
+    #rooms are saved here whenever they change, by default they aren't kept
+    store = RoomStore()
+
+    #games and moves are appended to the log when set
+    move_log = None
+
+    #a full state makes queued states and deltas out of date
+    superseded_events = {
+        "game:state:update": frozenset(["game:state:update", 
+            "game:state:delta"]),
+        "game:state:watch": frozenset(["game:state:watch"]),
+    }
+
+    #set when the client has asked for game:state:delta events
+    deltas = False
+    state_view = None
+
     def on_open(self, info):
         #user remains annonymous until they register, so they get no name
         self.name = None 
 
         self.participants.add(self)
 
+    def executor_key(self, room_name):
+        """
+        Handlers work on the active room whatever room the client names, so
+        events run in order for the active room
+        """
+        return getattr(self, "active_room", None)
+
     def on_close(self):
         log.debug("Player disconnected: %s", self.name)
 
         if hasattr(self, "active_room"):
+            #leave first, the closed session can't be sent to
+            self.leave_room(self.active_room)
+
             if self.name in self.active_room.players:
                 self.broadcast_event(self.active_room.participants, "players:disconnected", self.name)
                 self.active_room.players[self.name].socket = None
-
-            self.active_room.participants.remove(self)
+                self.active_room.players[self.name].disconnected_since = time.time()
 
         self.participants.remove(self)
 
+    def leave_room(self, room):
+        room.participants.discard(self)
+        if not room.participants:
+            room.idle_since = time.time()
+
+    @classmethod
+    def evict_idle_rooms(cls, now=None):
+        """
+        Removes rooms nobody has been in for config.ROOM_IDLE_TTL seconds,
+        and players that have been disconnected that long who aren't in the
+        room's game
+        """
+        if now is None:
+            now = time.time()
+        expired = now - config.ROOM_IDLE_TTL
+
+        for name, room in cls.rooms.items():
+            if room.idle_since is not None and room.idle_since <= expired:
+                log.debug("evicting idle room - '%s'", name)
+                del cls.rooms[name]
+                cls.store.delete_room(name)
+                continue
+
+            active_players = room.active_players or {}
+            removed = [player_name for player_name, room_player 
+                    in room.players.items()
+                    if room_player.socket is None 
+                    and player_name not in active_players
+                    and room_player.disconnected_since is not None
+                    and room_player.disconnected_since <= expired]
+            if not removed:
+                continue
+
+            for player_name in removed:
+                del room.players[player_name]
+            cls.store.save_room(name, room)
+
+            if room.participants:
+                socket = next(iter(room.participants))
+                for player_name in removed:
+                    socket.broadcast_event(room.participants, 
+                            "players:removed", player_name)
+
 
     ########
     # chat functions
     ########
 
-    @event("chat:message")
+    @event("chat:message", schema=basestring)
     def chat_message(self, room_name, message):
         log.debug("Chat message recieved for room '%s': %s: %s", room_name, self.name, message)
 
@@ -113,13 +299,17 @@ class SocketConnection(EventSocketConnection):
     def check_room(self, room):
         if room not in self.rooms:
             log.debug("creating room - '%s'", room)
-            self.rooms[room] = Room()
+            self.rooms[room] = Room(room)
+
+    def save_room(self, room):
+        if room.name is not None:
+            self.store.save_room(room.name, room)
 
     ########
     # account functions
     ########
 
-    @event("account:login")
+    @event("account:login", schema=basestring)
     def login(self, room_name, name):
         log.debug("user '%s' logged in to room '%s'", name, room_name)
 
@@ -129,28 +319,37 @@ class SocketConnection(EventSocketConnection):
 
         if name in room.players:
             room.players[name].socket = self
+            room.players[name].disconnected_since = None
             self.broadcast_event(room.participants, "players:reconnected", self.name)
 
-            game = room.active_game
-            if game:
-                hand = game.player_hand(name)
-                self.send_event("game:state:start", 
-                    convert_state_start(game.state, game.players, game.player_hands,
-                    game.current_player, game.played_cards.top_card, hand))
+            if room.active_game:
+                self.send_state("game:state:start", room.state_snapshot(), True)
         else:
             player = Player(name)
             room_player = RoomPlayer(name, self, player)
             room.players[name] = room_player
             self.broadcast_event(self.active_room.participants, "players:added", name)
+            self.save_room(room)
 
 
     @event("account:listing")
     def listing(self, room_name, message):
         log.debug("request for registered users")
 
+        #only sent when workers redirect clients rather than sit behind the 
+        #front, the client must reconnect to the port given and send the 
+        #listing again
+        if (self.redirect and self.shard is not None 
+                and room_name is not None and not self.shard.owns(room_name)):
+            self.send_event("room:redirect", self.shard.describe(room_name))
+            return
+
         self.check_room(room_name)
         room = self.rooms[room_name]
+        if hasattr(self, "active_room") and self.active_room is not room:
+            self.leave_room(self.active_room)
         room.participants.add(self)
+        room.idle_since = None
         self.active_room = room
         
 
@@ -164,6 +363,64 @@ class SocketConnection(EventSocketConnection):
     # game functions
     #######
 
+    def send_state(self, name, snapshot, full=False):
+        """
+        Sends the game state to this player.  If the player asked for deltas
+        and was sent an earlier state of the same game, only the changes
+        since that state are sent as a game:state:delta event
+        """
+        game = snapshot.game
+        last_view = self.state_view
+        self.state_view = snapshot.player_view(self.name)
+
+        if (full or not self.deltas or last_view is None 
+                or last_view.game is not game
+                or game.state == GameState.FINISHED):
+            self.send_event(name, snapshot.player_state(self.name, 
+                self.is_compact()))
+        else:
+            self.send_event("game:state:delta", 
+                    convert_state_delta(last_view, self.state_view, 
+                        self.is_compact()))
+
+    @event("game:state:deltas", schema=(bool, int))
+    def enable_deltas(self, room_name, enabled):
+        self.deltas = bool(enabled)
+
+    @event("game:state:resync")
+    def resync(self, room_name, message):
+        """
+        Resends the full state, used by clients that missed a delta
+        """
+        room = self.active_room
+        if not room.active_game:
+            return
+
+        snapshot = room.state_snapshot()
+        if self.name in room.active_players:
+            self.send_state("game:state:update", snapshot, True)
+        else:
+            self.send_event("game:state:watch", 
+                    snapshot.watch_state(self.is_compact()))
+
+    def broadcast_watch_state(self, room, snapshot):
+        """
+        Sends the game state to everyone in the room not playing, the state 
+        is encoded once for all of them
+        """
+        spectators = [participant for participant in room.participants
+                if participant.name not in room.active_players]
+
+        if not spectators:
+            return
+
+        compact_state = None
+        if any(spectator.is_compact() for spectator in spectators):
+            compact_state = snapshot.watch_state(True)
+
+        self.broadcast_event(spectators, "game:state:watch", 
+                snapshot.watch_state(), compact_state)
+
     @event("game:player:ready")
     def player_ready(self, room_name, message):
         log.debug("%s ready to start game", self.name)
@@ -181,6 +438,7 @@ class SocketConnection(EventSocketConnection):
         player_count = len(room.players)
         enough_players = player_count > 1 and player_count < 5
         if not all_ready or not enough_players:
+            self.save_room(room)
             return
 
         room.active_players = room.players.copy()
@@ -189,6 +447,11 @@ class SocketConnection(EventSocketConnection):
         players = [s.player for s in room.players.values()]
 
         game = create_game(players)
+        room.active_game = game
+        if self.move_log is not None and room.name is not None:
+            self.move_log.start_game(game_log_id(room.name, game), game, 
+                    config.STARTING_CARDS)
+        snapshot = room.state_snapshot()
 
         for participant in room.active_players.values():
             socket = participant.socket
@@ -196,78 +459,57 @@ class SocketConnection(EventSocketConnection):
                 #player is currently disconnected, just ignore him he will
                 #pick up state on reconnection
                 continue
-            hand = game.player_hand(socket.name)
-            socket.send_event("game:state:start", 
-                convert_state_start(game.state, game.players, game.player_hands,
-                game.current_player, game.played_cards.top_card, hand))
-
-        for participant in room.participants:
-            if participant.name not in room.active_players:
-                participant.send_event("game:state:watch", 
-                    convert_state_watch(game.state, game.players, game.player_hands,
-                        game.current_player, game.played_cards.top_card))
+            socket.send_state("game:state:start", snapshot, True)
 
+        self.broadcast_watch_state(room, snapshot)
 
-        room.active_game = game
 
         for participant in room.active_players.values():
             participant.ready = False
 
-    @event("game:player:move")
-    def player_move(self, room_name, message):
-        log.debug("%s plays move", self.name)
+        self.save_room(room)
 
-        #parse message (wait, pick, play)
-        #format
-        """
-            "type": "play",
-            "card": { rank: 4, suit: 4 }
-        """
+    @event("game:player:move", schema=parse_move)
+    def player_move(self, room_name, move):
+        log.debug("%s plays move", self.name)
 
         room = self.active_room
-        
-        move_type = convert_move_type(message["type"])
-        move = None
-        if move_type == MoveType.play:
-            card = message["card"]
-            move = GameMove(MoveType.play,
-                    convert_card(card["rank"], card["suit"]))
-            if "suit" in message:
-                move.suit = convert_suit(message["suit"])
-        else:
-            move = GameMove(move_type)
-        
         game = room.active_game
 
         play_response = game.play(self.name, move)
 
-        self.send_event("game:player:response", 
-                convert_play_response(play_response))
+        if self.is_compact():
+            self.send_event("game:player:response", 
+                    compact_play_response(play_response))
+        else:
+            self.send_event("game:player:response", 
+                    convert_play_response(play_response))
 
         if play_response.success:
+            snapshot = room.state_snapshot()
+
             for participant in room.active_players.values():
                 socket = participant.socket
                 if socket == None:
                     continue
-                hand = game.player_hand(socket.name)
-                socket.send_event("game:state:update", 
-                    convert_state_start(game.state, game.players, 
-                        game.player_hands,
-                        game.current_player, 
-                        game.played_cards.top_card, hand))
-
-            for participant in room.participants:
-                if participant.name not in room.active_players:
-                    participant.send_event("game:state:watch", 
-                        convert_state_watch(game.state, game.players, game.player_hands,
-                            game.current_player, game.played_cards.top_card))
+                socket.send_state("game:state:update", snapshot)
+
+            self.broadcast_watch_state(room, snapshot)
 
         if game.state == GameState.FINISHED:
+            #drop everything still holding the finished game
+            for participant in room.active_players.values():
+                if participant.socket is not None:
+                    participant.socket.state_view = None
             room.active_game = None
             room.active_players = None
+            room.snapshot = None
             for participant in room.players.values():
                 participant.ready = False
 
+        if play_response.success:
+            self.save_room(room)
+
 
 
 
@@ -289,8 +531,25 @@ def parse_args(argv=sys.argv[1:]):
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument("-d", "--debug", help="enable debug mode",
                     action="store_true")
+    parser.add_argument("-w", "--workers", type=int, default=config.WORKERS,
+                    help="number of worker processes to share rooms over")
+    parser.add_argument("-p", "--port", type=int, default=4500,
+                    help="port clients connect to, with several workers the "
+                    "workers listen on the ports after it")
+    parser.add_argument("-r", "--redirect", action="store_true",
+                    help="run the workers without a front process, clients "
+                    "must follow room:redirect events to the right worker")
+    parser.add_argument("-s", "--store", default=config.ROOM_STORE,
+                    help="sqlite database to save rooms to")
+    parser.add_argument("-l", "--move-log", default=config.MOVE_LOG,
+                    help="file to append games and moves to, each worker "
+                    "appends its index to the name")
+
+    arguments = parser.parse_args(argv)
+    if arguments.debug and arguments.workers > 1:
+        parser.error("debug mode can only run a single worker")
 
-    return parser.parse_args(argv)
+    return arguments
 
 
 
@@ -300,15 +559,54 @@ if __name__ == "__main__":
 
     arguments = parse_args()
 
+    #with several workers a front process takes the client port and passes
+    #clients on to the workers listening on the ports after it, unless 
+    #clients are redirected to the workers
+    front = arguments.workers > 1 and not arguments.redirect
+    worker_port = arguments.port + 1 if front else arguments.port
+
+    #fork before anything creates the IOLoop
+    index = 0
+    if arguments.workers > 1:
+        index = tornado.process.fork_processes(
+                arguments.workers + 1 if front else arguments.workers)
+    shard = Shard(index, arguments.workers, worker_port)
+
+    if front and index == arguments.workers:
+        ShardProxyConnection.shard = shard
+        front_application(shard).listen(arguments.port)
+        tornado.ioloop.IOLoop.instance().start()
+        sys.exit()
+
+    if arguments.workers > 1:
+        SocketConnection.shard = shard
+        SocketConnection.redirect = arguments.redirect
+
+    if arguments.move_log:
+        path = arguments.move_log
+        if arguments.workers > 1:
+            path = "%s.%d" % (path, index)
+        SocketConnection.move_log = MoveLog.open(path)
+
+    if arguments.store:
+        store = SqliteRoomStore(arguments.store, 
+                config.ROOM_STORE_FLUSH_INTERVAL)
+        SocketConnection.store = store
+        SocketConnection.rooms = load_rooms(store, SocketConnection.shard,
+                SocketConnection.move_log)
+
     BobSwitchRouter = sockjs.tornado.SockJSRouter(SocketConnection, 
             '/bobswitch')
 
     app = tornado.web.Application(
-            BobSwitchRouter.urls,
+            BobSwitchRouter.urls + [
+                (r"/shard", ShardRouterHandler, {"shard": shard}),
+            ],
             debug=arguments.debug
     )
 
-    app.listen(4500)
+    #workers behind the front are only reached through it
+    app.listen(worker_port + index, "127.0.0.1" if front else "")
 
     if arguments.debug:
         debug_application = tornado.web.Application([
@@ -316,4 +614,10 @@ if __name__ == "__main__":
         ])                    
         debug_application.listen(9433)
 
-    tornado.ioloop.IOLoop.instance().start()
+    tornado.ioloop.PeriodicCallback(SocketConnection.evict_idle_rooms,
+            config.ROOM_EVICTION_INTERVAL * 1000).start()
+
+    try:
+        tornado.ioloop.IOLoop.instance().start()
+    finally:
+        SocketConnection.store.close()
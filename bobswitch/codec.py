@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    Codec
+    ~~~~~~~~~~~~
+
+    JSON codecs used by the socket layer to encode and decode messages.
+    The standard library json module is always available, faster encoders
+    are used when installed.
+"""
+
+import logging
+logger = logging.getLogger()
+
+
+class Codec(object):
+    """
+    A named pair of encode and decode functions
+    """
+
+    def __init__(self, name, encode, decode):
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+
+    def __repr__(self):
+        return "Codec: %r" % (self.name,)
+
+
+def json_codec():
+    import json
+    return Codec("json", json.dumps, json.loads)
+
+def simplejson_codec():
+    import simplejson
+    return Codec("simplejson", simplejson.dumps, simplejson.loads)
+
+def ujson_codec():
+    import ujson
+    return Codec("ujson", ujson.dumps, ujson.loads)
+
+
+#fastest first, auto picks the first one that imports
+CODECS = [
+    ("ujson", ujson_codec),
+    ("simplejson", simplejson_codec),
+    ("json", json_codec),
+]
+
+
+def get_codec(name="json"):
+    """
+    Returns the codec with the given name, "auto" returns the fastest 
+    installed codec.  Falls back to the standard library json module if 
+    the requested codec is not installed
+    """
+    for codec_name, factory in CODECS:
+        if name != "auto" and name != codec_name:
+            continue
+
+        try:
+            return factory()
+        except ImportError:
+            if name != "auto":
+                logger.warning("json codec %s not installed, using json", name)
+                break
+
+    return json_codec()
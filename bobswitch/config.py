@@ -8,3 +8,39 @@ PORT = 3000
 
 STARTING_CARDS = 7
 DEBUG=False
+
+#json codec used for socket messages, "json" for the standard library, 
+#"ujson" or "simplejson" if installed or "auto" for the fastest installed
+JSON_CODEC = "json"
+
+#number of server processes, rooms are spread over them by name
+WORKERS = 1
+
+#sqlite database rooms are saved to so games survive a restart, None keeps
+#rooms in memory only
+ROOM_STORE = None
+
+#seconds changes to rooms are collected for before they are written
+ROOM_STORE_FLUSH_INTERVAL = 0.5
+
+#file every game and accepted move is appended to, None disables the log
+MOVE_LOG = None
+
+#seconds a room is kept after the last participant leaves, and a
+#disconnected player not in a game is kept in their room
+ROOM_IDLE_TTL = 600
+
+#seconds between checks for idle rooms
+ROOM_EVICTION_INTERVAL = 60
+
+#bytes of unsent messages a connection can hold before further events wait
+#in its outbox, messages build up while polling clients are between requests
+OUTBOX_BACKLOG_BYTES = 64 * 1024
+
+#events a connection's outbox can hold, once full the connection is closed
+#if OUTBOX_DISCONNECT_SLOW is set otherwise the oldest event is dropped
+OUTBOX_LIMIT = 100
+OUTBOX_DISCONNECT_SLOW = True
+
+#seconds between attempts to send a backed up connection's outbox
+OUTBOX_DRAIN_INTERVAL = 0.1
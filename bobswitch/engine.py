@@ -1,7 +1,9 @@
 import random
+import struct
 import os
 
-from models import Deck, Card, Suit, Rank, Hand, PlayedCards
+from models import Deck, Rank, Hand, PlayedCards, RANK_IDS, \
+        SUIT_MASKS, RANK_MASKS, NUMBER_OF_CARDS, CARDS
 from flufl.enum import Enum
 
 import logging
@@ -24,15 +26,51 @@ class GameDirection(Enum):
     anticlockwise = 1
 
 
-def create_deck():
+#integer rank ids of the special cards, compared against Card.rank_id
+ACE = RANK_IDS[Rank.ace]
+TWO = RANK_IDS[Rank.two]
+FOUR = RANK_IDS[Rank.four]
+EIGHT = RANK_IDS[Rank.eight]
+JACK = RANK_IDS[Rank.jack]
+
+ACE_MASK = RANK_MASKS[ACE]
+EIGHT_MASK = RANK_MASKS[EIGHT]
+ALL_CARDS_MASK = (1 << NUMBER_OF_CARDS) - 1
+
+
+#seeds are stored as 32 bit unsigned integers
+SEED_LIMIT = 1 << 32
+
+
+def new_seed():
+    """
+    Returns a random 32 bit seed for a deck
+    """
+    return struct.unpack("<I", os.urandom(4))[0]
+
+
+def create_deck(seed=None, rand=None):
     """
     Returns a deck populated with the standard 52 cards from a plain deck
+
+    The deck shuffles with rand if passed, otherwise with a Random seeded 
+    from seed.  When neither is given a new seed is chosen, the seed used 
+    is recorded on the deck so the deal can be reproduced.  Seeds are 32 bit
+    unsigned integers so they fit a game snapshot, raises ValueError for
+    any other seed
     """
-    rand = random.Random(os.urandom(4))
-    deck = Deck(rand)
-    for suit in Suit:
-        for rank in Rank:
-            deck.add_card(Card(suit, rank))
+    if seed is not None and (not isinstance(seed, (int, long)) 
+            or not 0 <= seed < SEED_LIMIT):
+        raise ValueError("seed must be a 32 bit unsigned integer not %r" % 
+                (seed,))
+
+    if rand is None:
+        if seed is None:
+            seed = new_seed()
+        rand = random.Random(seed)
+
+    deck = Deck(rand, seed)
+    deck.add_cards(CARDS)
     
     return deck
 
@@ -54,67 +92,150 @@ def deal_player_hands(number_of_cards, players, deck):
     return player_hands
 
 
+def playable_mask(top_card, game_state, first_play=False):
+    """
+    Returns the mask of every card that could be played on top of the 
+    given card in the given state, and this with a hand mask to find the 
+    cards a player can play
+    """
+    top_rank = top_card.rank_id
+    if first_play and top_rank == ACE:
+        return ALL_CARDS_MASK
+
+    if game_state is GameState.WAIT:
+        #eights still have to follow the top card like any other play
+        return EIGHT_MASK & (SUIT_MASKS[top_card.suit_id] | 
+                RANK_MASKS[top_rank])
+
+    if game_state is GameState.PICK:
+        return RANK_MASKS[top_rank]
+
+    return SUIT_MASKS[top_card.suit_id] | RANK_MASKS[top_rank] | ACE_MASK
+
+
+def legal_moves(hand, top_card, game_state, first_play=False):
+    """
+    Returns a list of every move that valid_pick or valid_play would accept
+    for the given hand, built in one pass over the hand.  Aces are returned
+    without a suit selected
+    """
+    return TurnSummary(hand, top_card, game_state, first_play).legal_moves()
+
+
 def valid_pick(hand, top_card, game_state, first_play=False):
     """
     Checks whether a pick would be valid given the hand sent, a pick
     is valid if the user doesn't have any cards of the same suit, rank
     or an ace. Cant pick when waiting due to an eight
     """
-    if first_play and top_card.rank == Rank.ace:
+    top_rank = top_card.rank_id
+    if first_play and top_rank == ACE:
         return False
 
-    if game_state == GameState.WAIT:
+    if game_state is GameState.WAIT:
         log.debug("Attempting to pick when game is in wait mode")
         return False
 
-    #check state is pick and top card rank not present in hand
-    if game_state == GameState.PICK:
-        pick_cards = [card for card in hand.cards
-                if card.rank == top_card.rank]
-
-        return not pick_cards
-
-    matching_cards = [card for card in hand.cards 
-            if card.suit == top_card.suit
-            or card.rank == top_card.rank
-            or card.rank == Rank.ace]
+    #in pick state only the top card rank blocks a pick
+    matching_cards = hand.mask & playable_mask(top_card, game_state)
 
-    if matching_cards:
+    if matching_cards and game_state is not GameState.PICK:
         log.debug("attempting to pick when playing is possible")
 
     return not matching_cards
 
 def valid_play(card, hand, top_card, game_state, first_play=False):
 
-    if first_play and top_card.rank == Rank.ace:
+    top_rank = top_card.rank_id
+    if first_play and top_rank == ACE:
         return True
 
-    eights = [c for c in hand.cards if c.rank == Rank.eight]
-    if game_state == GameState.WAIT and card is None and not eights:
-        return True
+    if game_state is GameState.WAIT:
+        if card is None:
+            return not hand.mask & EIGHT_MASK
 
-    if game_state == GameState.WAIT and card is None and eights:
-        return False 
+        if card.rank_id != EIGHT:
+            return False
 
-    if game_state == GameState.WAIT and card.rank != Rank.eight:
+    if card is None:
         return False
 
-    if game_state == GameState.PICK:
-        if top_card.rank != card.rank:
+    rank = card.rank_id
+    if game_state is GameState.PICK:
+        if top_rank != rank:
             return False
 
     if not hand.contains_card(card): 
         return False
 
-    if card.rank == Rank.ace:
+    if rank == ACE:
         return True
 
-    if card.rank == top_card.rank or card.suit == top_card.suit:
+    if rank == top_rank or card.suit_id == top_card.suit_id:
         return True
 
     return False 
 
 
+class TurnSummary(object):
+    """
+    Everything valid_pick and valid_play need to know about one position
+    of a game, worked out once from the hand's mask.  Every query for that
+    position, such as a client retrying an invalid move, is then answered
+    without looking at the hand again
+    """
+
+    def __init__(self, hand, top_card, game_state, first_play=False, 
+            version=None):
+        self.hand = hand
+        self.hand_mask = hand.mask
+        self.top_card = top_card
+        self.game_state = game_state
+        self.first_play = first_play
+        self.version = version
+
+        #anything goes on the first play onto an ace
+        self.any_move = first_play and top_card.rank_id == ACE
+        self.playable = hand.mask & playable_mask(top_card, game_state, 
+                first_play)
+        self.can_wait = self.any_move or (game_state is GameState.WAIT 
+                and not hand.mask & EIGHT_MASK)
+        #in pick state only the top card rank blocks a pick
+        self.can_pick = (not self.any_move 
+                and game_state is not GameState.WAIT
+                and not hand.mask & playable_mask(top_card, game_state))
+
+    def matches(self, hand, top_card, game_state, first_play, version):
+        return (self.version == version and self.hand is hand
+                and self.hand_mask == hand.mask and self.top_card is top_card
+                and self.game_state is game_state 
+                and self.first_play == first_play)
+
+    def valid_move(self, move):
+        if move.move_type is MoveType.pick:
+            return self.can_pick
+
+        card = move.card
+        if card is None:
+            return self.can_wait
+
+        return self.any_move or (self.playable >> card.index) & 1 == 1
+
+    def legal_moves(self):
+        moves = [GameMove(MoveType.play, card) for card in self.hand.cards
+                if (self.playable >> card.index) & 1]
+
+        if self.any_move:
+            moves.append(GameMove(MoveType.wait))
+        elif self.game_state is GameState.WAIT:
+            if self.can_wait:
+                moves.append(GameMove(MoveType.wait))
+        elif not self.playable:
+            moves.append(GameMove(MoveType.pick))
+
+        return moves
+
+
 class PlayerHand(object):
     """
     Holder class to keep a link to player and hand together
@@ -165,11 +286,26 @@ class GameStatus(object):
 
 class Game(object):
 
+    #set by MoveLog.start_game, accepted moves are recorded to the log
+    move_log = None
+    log_id = None
+
+    #TurnSummary of the current position, dropped on every accepted move
+    turn = None
+
     def __init__(self, players, number_of_cards, deck, starting_player=1):
         self.deck = deck 
+        self.seed = deck.seed
 
         self.first_play = True
 
+        #number of times the played cards were shuffled back into the deck
+        self.reshuffles = 0
+
+        #incremented on every accepted move so cached views of the game
+        #can tell when they are stale
+        self.version = 0
+
         self.current_player = starting_player 
         self.player_hands = deal_player_hands(number_of_cards, players, deck)
         self.players = players
@@ -181,7 +317,7 @@ class Game(object):
 
         #set direction
         self.direction = GameDirection.clockwise
-        if top_card.rank == Rank.jack:
+        if top_card.rank_id == JACK:
             self.set_next_player(top_card, True)
 
         #set state machine
@@ -189,16 +325,17 @@ class Game(object):
         self.update_state(top_card)
 
     def update_state(self, card):
-        if card is None:
+        rank = card.rank_id if card is not None else None
+        if rank is None:
             self.state = GameState.NORMAL
             self.accumulated_count = 0
-        elif card.rank == Rank.two:
+        elif rank == TWO:
             self.state = GameState.PICK
             self.accumulated_count = self.accumulated_count + 2
-        elif card.rank == Rank.four:
+        elif rank == FOUR:
             self.state = GameState.PICK
             self.accumulated_count = self.accumulated_count + 4
-        elif card.rank == Rank.eight:
+        elif rank == EIGHT:
             self.state = GameState.WAIT
             self.accumulated_count = 0
         else:
@@ -219,7 +356,8 @@ class Game(object):
         player_counts = [player_hand.hand.number_of_cards() for _, player_hand 
                 in self.player_hands.items()]
 
-        return GameStatus(self.current_player, self.played_cards.top_card, player_counts)
+        return GameStatus(self.current_player, self.played_cards.active_card(), 
+                player_counts)
 
     def play(self, player_name, move):
         """
@@ -231,24 +369,26 @@ class Game(object):
 
         #is move valid
         hand = self.player_hand(current_player.name)
-        if not self.valid_move(move, hand, self.played_cards.top_card):
+        if not self.valid_move(move, hand, self.played_cards.active_card()):
             return invalid_play_response("Not a valid move")
 
-        if move.move_type == MoveType.pick:
+        if self.move_log is not None:
+            self.move_log.record_move(self, player_name, move)
+
+        if move.move_type is MoveType.pick:
             card_count = 1
-            if self.state == GameState.PICK:
+            if self.state is GameState.PICK:
                 card_count = self.accumulated_count
                 self.accumulated_count = 0
                 self.state = GameState.NORMAL
 
-            for _ in xrange(card_count):
-                self.pick(hand)
-        elif move.move_type == MoveType.play:
+            self.pick_many(hand, card_count)
+        elif move.move_type is MoveType.play:
             hand.remove_card(move.card)
             self.played_cards.add_card(move.card, move.suit)
             self.update_state(move.card)
             
-        elif move.move_type == MoveType.wait:
+        elif move.move_type is MoveType.wait:
             self.update_state(move.card)
 
 
@@ -261,15 +401,18 @@ class Game(object):
             self.state = GameState.FINISHED
 
         self.first_play = False
+        self.version = self.version + 1
+        self.turn = None
 
         return valid_play_response()
             
     def set_next_player(self, card, start_move=False):
         #in two player jack means play again, except on deal when other player should play
-        if len(self.players) == 2 and card and card.rank == Rank.jack and not start_move:
+        is_jack = card is not None and card.rank_id == JACK
+        if len(self.players) == 2 and is_jack and not start_move:
             return
 
-        if card and card.rank == Rank.jack:
+        if is_jack:
             if self.direction == GameDirection.clockwise:
                 self.direction = GameDirection.anticlockwise
             else:
@@ -289,22 +432,63 @@ class Game(object):
 
 
     def pick(self, hand):
-        if not self.deck.has_card():
-            cards = self.played_cards.return_played_cards()
-            self.deck.add_cards(cards)
+        self.pick_many(hand, 1)
+
+    def pick_many(self, hand, count):
+        """
+        Deals count cards from the deck into the hand.  If the deck runs out 
+        the played cards are shuffled back in once, when there are still too
+        few cards the hand gets whatever is left
+        """
+        available = self.deck.number_of_cards()
+        if count <= available:
+            hand.add_cards(self.deck.deal_cards(count))
+            return
+
+        cards = self.deck.deal_cards(available)
+        self.reshuffle()
+
+        count = min(count - available, self.deck.number_of_cards())
+        cards.extend(self.deck.deal_cards(count))
+        hand.add_cards(cards)
+
+    def reshuffle(self):
+        """
+        Shuffle the played cards, except the top card, back into the deck
+        """
+        self.deck.add_cards(self.played_cards.return_played_cards())
+        self.deck.shuffle(passes=1)
+        self.reshuffles = self.reshuffles + 1
 
-            self.deck.shuffle()
 
-        card = self.deck.deal_card()
-        hand.add_card(card)
+    def legal_moves(self, player_name):
+        """
+        Return the list of moves the given player could make, empty if it
+        is not the players turn or the game is finished
+        """
+        current_player = self.players[self.current_player-1]
+        if current_player.name != player_name or self.state is GameState.FINISHED:
+            return []
+
+        return self.turn_summary(self.player_hand(player_name), 
+                self.played_cards.active_card()).legal_moves()
+
+    def turn_summary(self, hand, top_card):
+        """
+        Returns the TurnSummary for the hand in the current position, reused 
+        until the position changes
+        """
+        summary = self.turn
+        if summary is None or not summary.matches(hand, top_card, self.state,
+                self.first_play, self.version):
+            summary = TurnSummary(hand, top_card, self.state, 
+                    self.first_play, self.version)
+            self.turn = summary
 
+        return summary
 
     def valid_move(self, move, hand, top_card):
-        #check pick vs play
-        if move.move_type == MoveType.pick:
-            return valid_pick(hand, top_card, self.state, self.first_play)
-        
-        return valid_play(move.card, hand, top_card, self.state, self.first_play)
+        return self.turn_summary(hand, top_card).valid_move(move)
 
          
 
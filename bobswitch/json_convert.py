@@ -1,6 +1,7 @@
+from models import Card, mask_indexes
 
 def convert_card(card):
-    return { "suit": int(card.suit), "rank": int(card.rank) }
+    return { "suit": card.suit_id, "rank": card.rank_id }
 
 def convert_hand(hand):
     return [convert_card(card) for card in hand.cards]
@@ -17,42 +18,216 @@ def convert_state(state):
     else:
         return "finished"
 
-def convert_state_start(state, players, player_hands, starting_player, top_card, hand):
-    players = [{ 
+def convert_direction(direction):
+    return direction.name
+
+def convert_players(players, player_hands):
+    return [{ 
         "name": player.name, 
         "count": player_hands[player.name].hand.number_of_cards(),
         "played": player.played,
         "won": player.won
         } for player in players]
 
-    return {
-        "players": players,
-        "starting_player": starting_player,
-        "number_of_players": len(players),
-        "hand": convert_hand(hand),
-        "top_card": convert_card(top_card),
-        "state": convert_state(state)
-    }
+def convert_state_start(state, players, player_hands, starting_player, top_card, hand,
+        direction=None):
+    state = convert_state_watch(state, players, player_hands, starting_player,
+            top_card, direction)
+    state["hand"] = convert_hand(hand)
 
-def convert_state_watch(state, players, player_hands, starting_player, top_card):
-    players = [{ 
-        "name": player.name, 
-        "count": player_hands[player.name].hand.number_of_cards(),
-        "played": player.played,
-        "won": player.won
-        } for player in players]
+    return state
 
-    return {
+def convert_state_watch(state, players, player_hands, starting_player, top_card,
+        direction=None):
+    players = convert_players(players, player_hands)
+
+    state = {
         "players": players,
         "starting_player": starting_player,
         "number_of_players": len(players),
         "top_card": convert_card(top_card),
         "state": convert_state(state)
     }
+    if direction is not None:
+        state["direction"] = convert_direction(direction)
+
+    return state
 
 def convert_play_response(play_response):
     return {
         "success": play_response.success,
         "message": play_response.message
     }
-    
+
+
+#compact forms of the messages for connections using the compact protocol,
+#cards are sent as their 0-51 index and objects as positional arrays
+
+def compact_hand(hand):
+    return [card.index for card in hand.cards]
+
+def compact_players(players, player_hands):
+    return [[
+        player.name, 
+        player_hands[player.name].hand.number_of_cards(),
+        player.played,
+        player.won
+        ] for player in players]
+
+def compact_state_start(state, players, player_hands, starting_player, top_card, hand,
+        direction=None):
+    state = compact_state_watch(state, players, player_hands, starting_player,
+            top_card, direction)
+    state.append(compact_hand(hand))
+
+    return state
+
+def compact_state_watch(state, players, player_hands, starting_player, top_card,
+        direction=None):
+    state = [
+        compact_players(players, player_hands),
+        starting_player,
+        top_card.index,
+        int(state)
+    ]
+    if direction is not None:
+        state.append(int(direction))
+
+    return state
+
+def compact_play_response(play_response):
+    return [play_response.success, play_response.message]
+
+
+class StateView(object):
+    """
+    The parts of the game state seen by one player that deltas are 
+    computed from, cards are held as indexes and masks
+    """
+
+    def __init__(self, game, version, hand_mask, counts, top_card, state, 
+            current_player, direction):
+        self.game = game
+        self.version = version
+        self.hand_mask = hand_mask
+        self.counts = counts
+        self.top_card = top_card
+        self.state = state
+        self.current_player = current_player
+        self.direction = direction
+
+
+def convert_state_delta(old_view, new_view, compact=False):
+    """
+    Returns the changes between two views of the same game, seq is the 
+    version of the new view and base the version the delta applies to.  
+    Unchanged fields are left out, or null in the compact form
+    """
+    added = mask_indexes(new_view.hand_mask & ~old_view.hand_mask)
+    removed = mask_indexes(old_view.hand_mask & ~new_view.hand_mask)
+    counts = [[position, count] for position, (old_count, count) 
+            in enumerate(zip(old_view.counts, new_view.counts)) 
+            if old_count != count]
+
+    top_card = None
+    if new_view.top_card != old_view.top_card:
+        top_card = new_view.top_card
+    state = new_view.state if new_view.state is not old_view.state else None
+    current_player = None
+    if new_view.current_player != old_view.current_player:
+        current_player = new_view.current_player
+    direction = None
+    if new_view.direction is not old_view.direction:
+        direction = new_view.direction
+
+    if compact:
+        return [
+            new_view.version,
+            old_view.version,
+            added or None,
+            removed or None,
+            counts or None,
+            top_card,
+            int(state) if state is not None else None,
+            current_player,
+            int(direction) if direction is not None else None
+        ]
+
+    delta = {
+        "seq": new_view.version,
+        "base": old_view.version
+    }
+    if added:
+        delta["added"] = [convert_card(Card.from_index(index)) for index in added]
+    if removed:
+        delta["removed"] = [convert_card(Card.from_index(index)) for index in removed]
+    if counts:
+        delta["counts"] = counts
+    if top_card is not None:
+        delta["top_card"] = convert_card(Card.from_index(top_card))
+    if state is not None:
+        delta["state"] = convert_state(state)
+    if current_player is not None:
+        delta["starting_player"] = current_player
+    if direction is not None:
+        delta["direction"] = convert_direction(direction)
+
+    return delta
+
+
+class StateSnapshot(object):
+    """
+    Caches the public state of a game, the part of the state messages that 
+    is the same for every player and spectator.  The cache is rebuilt when
+    the games version changes, returned states share the cached structure 
+    so must not be modified
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.version = None
+        self.public_states = {}
+
+    def watch_state(self, compact=False):
+        """
+        Returns the state sent to spectators
+        """
+        game = self.game
+        if self.version != game.version:
+            self.public_states = {}
+            self.version = game.version
+
+        state = self.public_states.get(compact)
+        if state is None:
+            convert = compact_state_watch if compact else convert_state_watch
+            state = convert(game.state, game.players, game.player_hands, 
+                    game.current_player, game.played_cards.active_card(), 
+                    game.direction)
+            self.public_states[compact] = state
+
+        return state
+
+    def player_view(self, player_name):
+        """
+        Returns the StateView of the game for a player
+        """
+        game = self.game
+        counts = tuple(game.player_hands[player.name].hand.number_of_cards()
+                for player in game.players)
+
+        return StateView(game, game.version, game.player_hand(player_name).mask,
+                counts, game.played_cards.active_card().index, game.state, 
+                game.current_player, game.direction)
+
+    def player_state(self, player_name, compact=False):
+        """
+        Returns the state sent to a player, the public state plus their hand
+        """
+        hand = self.game.player_hand(player_name)
+        if compact:
+            return self.watch_state(True) + [compact_hand(hand)]
+
+        state = dict(self.watch_state())
+        state["hand"] = convert_hand(hand)
+
+        return state
@@ -1,3 +1,5 @@
+from collections import Counter
+
 from flufl.enum import Enum
 
 class Suit(Enum):
@@ -21,6 +23,48 @@ class Rank(Enum):
     queen = 12
     king = 13
 
+#lookup tables for the compact 0-51 card encoding, a card index is
+#suit_id * 13 + (rank_id - 1) so integer comparisons can be used in place
+#of enum comparisons on the hot paths
+SUITS = list(Suit)
+RANKS = list(Rank)
+NUMBER_OF_CARDS = len(SUITS) * len(RANKS)
+
+SUIT_IDS = dict((suit, int(suit)) for suit in SUITS)
+RANK_IDS = dict((rank, int(rank)) for rank in RANKS)
+
+CARD_SUIT_IDS = [index // len(RANKS) for index in xrange(NUMBER_OF_CARDS)]
+CARD_RANK_IDS = [index % len(RANKS) + 1 for index in xrange(NUMBER_OF_CARDS)]
+
+
+def card_index(suit_id, rank_id):
+    """
+    Returns the 0-51 integer encoding of the card with the given suit and
+    rank ids
+    """
+    return suit_id * len(RANKS) + rank_id - 1
+
+#bitmasks of every card of a suit (by suit id) and of a rank (by rank id),
+#used to query a Hand's bitmask with a single bitwise and
+SUIT_MASKS = [sum(1 << card_index(SUIT_IDS[suit], RANK_IDS[rank]) for rank in RANKS)
+        for suit in SUITS]
+RANK_MASKS = [0] + [sum(1 << card_index(SUIT_IDS[suit], RANK_IDS[rank]) for suit in SUITS)
+        for rank in RANKS]
+
+
+def mask_indexes(mask):
+    """
+    Returns the card indexes set in the given mask, lowest first
+    """
+    indexes = []
+    while mask:
+        low_bit = mask & -mask
+        indexes.append(low_bit.bit_length() - 1)
+        mask ^= low_bit
+
+    return indexes
+
+
 class Player(object):
     """
     Represents a player in the room
@@ -48,49 +92,126 @@ class Room(object):
 class Card(object):
     """
     Represents a card from a standard deck of cards, eg- ace of clubs
+
+    There is exactly one immutable Card for each of the 52 cards, creating
+    a card returns the interned instance so cards can be shared freely and
+    compared by identity.  Suit and rank enums are looked up from the index
+    when requested
     """
 
-    def __init__(self, suit, rank):
+    __slots__ = ("index", "suit_id", "rank_id")
+
+    def __new__(cls, suit, rank):
         """
         suit and rank must be of the enum type Rank and Card, if they
         are not a TypeError will be raised.
         """
-        if suit not in Suit:
+        suit_id = SUIT_IDS.get(suit)
+        if suit_id is None:
             raise TypeError("suit argument must be off type Suit")
-        if rank not in Rank:
+        rank_id = RANK_IDS.get(rank)
+        if rank_id is None:
             raise TypeError("rank argument must be off type Rank")
 
-        self.suit = suit
-        self.rank = rank
+        return CARDS[card_index(suit_id, rank_id)]
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Returns the card for the given 0-51 index
+        """
+        return CARDS[index]
+
+    @classmethod
+    def _create(cls, index):
+        card = object.__new__(cls)
+        object.__setattr__(card, "index", index)
+        object.__setattr__(card, "suit_id", CARD_SUIT_IDS[index])
+        object.__setattr__(card, "rank_id", CARD_RANK_IDS[index])
+        return card
+
+    @property
+    def suit(self):
+        return SUITS[self.suit_id]
+
+    @property
+    def rank(self):
+        return RANKS[self.rank_id - 1]
+
+    def __setattr__(self, name, value):
+        raise AttributeError("cards are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("cards are immutable")
+
+    def __reduce__(self):
+        return (get_card, (self.suit_id, self.rank_id))
 
     def __eq__(self, other):
-        return (self.suit == other.suit and self.rank == other.rank)
+        if not isinstance(other, Card):
+            return NotImplemented
+        return self.index == other.index
+
+    def __ne__(self, other):
+        if not isinstance(other, Card):
+            return NotImplemented
+        return self.index != other.index
 
-    def __neq__(self, other):
-        return not self.__eq__(other)
+    def __hash__(self):
+        return self.index
 
     def __repr__(self):
         return "Card: suit - %r, rank - %r" % (self.suit.name, self.rank.name)
 
+#the interned cards in index order
+CARDS = [Card._create(index) for index in xrange(NUMBER_OF_CARDS)]
+
+
+def get_card(suit_id, rank_id):
+    """
+    Returns the card with the given suit and rank ids
+    """
+    return CARDS[card_index(suit_id, rank_id)]
+
 
 class CardGroup(object):
     """
     Base class for a groups of cards such as Hands, Decks etc
+
+    An indexed group also keeps a multiset of its cards alongside the 
+    ordered list so membership doesn't scan the list, methods that change 
+    cards directly keep counts in step with add_counts/remove_counts
     """
-    def __init__(self):
+    def __init__(self, indexed=False):
         self.cards = []
+        self.counts = Counter() if indexed else None
     
     def add_card(self, card):
         """
         adds the given card to the hand
         """
         self.cards.append(card)
+        if self.counts is not None:
+            self.counts[card] += 1
 
     def add_cards(self, cards):
         """
         adds the given cards to the hand
         """
+        cards = list(cards)
         self.cards.extend(cards)
+        self.add_counts(cards)
+
+    def add_counts(self, cards):
+        if self.counts is not None:
+            self.counts.update(cards)
+
+    def remove_counts(self, cards):
+        if self.counts is not None:
+            self.counts.subtract(cards)
+            for card in cards:
+                if self.counts[card] <= 0:
+                    del self.counts[card]
 
     def number_of_cards(self):
         return len(self.cards)
@@ -99,27 +220,87 @@ class CardGroup(object):
         """
         Returns True if hand contains passed card
         """
+        if self.counts is not None:
+            return self.counts[card] > 0
+
         return card in self.cards
 
+    def remove_card(self, card):
+        """
+        Returns True if the card was removed from the hand, returns
+        False if the card was not present
+        """
+        if not self.contains_card(card):
+            return False
+
+        self.cards.remove(card)
+        self.remove_counts((card,))
+
+        return True
+
 
 class Hand(CardGroup):
     """
     Represents a set of cards 
+
+    Alongside the ordered list of cards the hand keeps a 52 bit mask of the
+    card indexes it holds, membership and suit/rank queries are answered
+    from the mask.  Hands are dealt from a single deck so hold each card at
+    most once
     """
 
     def __init__(self):
         super(Hand,self).__init__()
 
+        self.mask = 0
+
+    def add_card(self, card):
+        """
+        adds the given card to the hand
+        """
+        super(Hand, self).add_card(card)
+        self.mask |= 1 << card.index
+
+    def add_cards(self, cards):
+        """
+        adds the given cards to the hand
+        """
+        #cards may be a generator, it's walked for the list and the mask
+        cards = list(cards)
+        super(Hand, self).add_cards(cards)
+        for card in cards:
+            self.mask |= 1 << card.index
+
+    def contains_card(self, card):
+        """
+        Returns True if hand contains passed card
+        """
+        return (self.mask >> card.index) & 1 == 1
+
+    def has_suit(self, suit_id):
+        """
+        Returns True if hand contains any card of the given suit id
+        """
+        return self.mask & SUIT_MASKS[suit_id] != 0
+
+    def has_rank(self, rank_id):
+        """
+        Returns True if hand contains any card of the given rank id
+        """
+        return self.mask & RANK_MASKS[rank_id] != 0
+
     def remove_card(self, card):
         """
         Returns True if the card was removed from the hand, returns
         False if the card was not present
         """
-        if self.contains_card(card):
-            self.cards.remove(card)
-            return True
-        
-        return False
+        if not super(Hand, self).remove_card(card):
+            return False
+
+        #a hand is dealt from a single deck so never holds a card twice
+        self.mask &= ~(1 << card.index)
+
+        return True
 
     def __repr__(self):
         return "Hand: %r" % (self.cards,)
@@ -130,18 +311,47 @@ class Deck(CardGroup):
     represents a deck of cards stored in an order
     """
 
-    def __init__(self, random):
-        super(Deck,self).__init__()
+    def __init__(self, random, seed=None, indexed=False):
+        """
+        random is the Random instance used to shuffle, seed is the seed it
+        was created from if known
+        """
+        super(Deck,self).__init__(indexed)
 
         self.random = random
+        self.seed = seed
 
     def deal_card(self):
-        return self.cards.pop()
+        card = self.cards.pop()
+        self.remove_counts((card,))
+        return card
+
+    def deal_cards(self, count):
+        """
+        deals count cards in the same order as calling deal_card count 
+        times, raises IndexError if the deck doesn't hold enough cards
+        """
+        remaining = len(self.cards) - count
+        if remaining < 0:
+            raise IndexError("deal from deck with too few cards")
+
+        cards = self.cards[remaining:]
+        del self.cards[remaining:]
+        self.remove_counts(cards)
+        cards.reverse()
 
-    def shuffle(self):
-        self.random.shuffle(self.cards)
-        self.random.shuffle(self.cards)
-        self.random.shuffle(self.cards)
+        return cards
+
+    def shuffle(self, random=None, passes=3):
+        """
+        shuffles the deck using the decks own Random unless another is passed,
+        a single pass is already a uniform shuffle
+        """
+        if random is None:
+            random = self.random
+
+        for _ in xrange(passes):
+            random.shuffle(self.cards)
 
     def has_card(self):
         return self.number_of_cards() != 0
@@ -154,11 +364,15 @@ class Deck(CardGroup):
 class PlayedCards(CardGroup):
     """
     represents the played cards
+
+    When an ace is played the suit the player chose is kept as declared_suit
+    alongside it, the ace itself is unchanged
     """
-    def __init__(self):
-        super(PlayedCards,self).__init__()
+    def __init__(self, indexed=False):
+        super(PlayedCards,self).__init__(indexed)
 
         self.top_card = None
+        self.declared_suit = None
 
     def add_card(self, card, suit_override=None):
         """
@@ -170,12 +384,23 @@ class PlayedCards(CardGroup):
         else:
             self.top_card = card
 
-        if suit_override:
-            self.top_card.suit = suit_override
+        self.declared_suit = suit_override
+
+    def active_card(self):
+        """
+        Returns the card the next play must follow, the top card or if a 
+        suit was declared the card of that suit with the top card's rank
+        """
+        if self.declared_suit is None or self.top_card is None:
+            return self.top_card
+
+        return get_card(SUIT_IDS[self.declared_suit], self.top_card.rank_id)
 
     def return_played_cards(self):
         old_cards = self.cards
         self.cards = []
+        if self.counts is not None:
+            self.counts.clear()
         return old_cards
 
 
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+    Move log
+    ~~~~~~~~~~~~
+
+    Append-only log of every game started and every move accepted, one json
+    record per line.  A game is fully determined by its seed, players and
+    moves, so the log is enough to rebuild any game by playing the moves
+    back through the engine.  Replays stream the log a line at a time and
+    only keep unfinished games in memory, so logs of any size can be read.
+
+    Records are::
+
+        {"type": "game", "game": id, "seed": seed, "players": [names],
+            "cards": number of cards, "starting_player": seat}
+        {"type": "move", "game": id, "version": version, "player": name,
+            "move": [move type, card index or null, suit id or null]}
+        {"type": "restore", "game": id, "snapshot": base64 game snapshot}
+
+    Logged games must be dealt like bobswitch.create_game, a deck created
+    from the seed and shuffled once.  A game restored from a room store is
+    logged as a restore record holding its snapshot, including the deck's
+    Random, and replays carry on from the snapshot.
+"""
+
+import sys
+import json
+import time
+import base64
+import argparse
+
+from engine import create_deck, Game, GameMove, GameState, MoveType
+from models import Card, Player, SUITS, SUIT_IDS
+from snapshot import dump_game, load_game
+from json_convert import convert_state_watch
+
+MOVE_TYPES = list(MoveType)
+MOVE_TYPE_IDS = dict((move_type, position)
+        for position, move_type in enumerate(MOVE_TYPES))
+
+
+def encode_move(move):
+    card = move.card.index if move.card is not None else None
+    suit = SUIT_IDS[move.suit] if move.suit is not None else None
+
+    return [MOVE_TYPE_IDS[move.move_type], card, suit]
+
+def decode_move(encoded):
+    move_type, card, suit = encoded
+
+    return GameMove(MOVE_TYPES[move_type],
+            Card.from_index(card) if card is not None else None,
+            SUITS[suit] if suit is not None else None)
+
+
+class MoveLog(object):
+    """
+    Writes the log to a file opened for appending, each record is written
+    and flushed as a single line so a crash loses at most the move being
+    played
+    """
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+
+    @classmethod
+    def open(cls, path):
+        return cls(open(path, "a"))
+
+    def write(self, record):
+        self.log_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.log_file.flush()
+
+    def attach(self, game_id, game):
+        """
+        Logs future moves of the game without writing a record
+        """
+        game.move_log = self
+        game.log_id = game_id
+
+    def start_game(self, game_id, game, number_of_cards, starting_player=1):
+        """
+        Writes the game record and logs every move of the game from now on
+        """
+        self.write({
+            "type": "game",
+            "game": game_id,
+            "seed": game.seed,
+            "players": [player.name for player in game.players],
+            "cards": number_of_cards,
+            "starting_player": starting_player
+        })
+        self.attach(game_id, game)
+
+    def restore_game(self, game_id, game):
+        """
+        Writes a restore record and logs every move of the game from now on,
+        used for games restored from a room store.  The restored game doesn't
+        shuffle with the Random of the logged game and the log may hold moves
+        the store never saw, so replays restart the game from the snapshot
+        """
+        self.write({
+            "type": "restore",
+            "game": game_id,
+            "snapshot": base64.b64encode(dump_game(game, random_state=True))
+        })
+        self.attach(game_id, game)
+
+    def record_move(self, game, player_name, move):
+        """
+        Called by the game for every move it accepts, before the move is
+        applied
+        """
+        self.write({
+            "type": "move",
+            "game": game.log_id,
+            "version": game.version + 1,
+            "player": player_name,
+            "move": encode_move(move)
+        })
+
+    def close(self):
+        self.log_file.close()
+
+
+def read_log(lines):
+    """
+    Yields the records of a log, lines can be a file or any iterable of
+    lines.  A partly written last line, left by a crash, is skipped
+    """
+    for line in lines:
+        if not line.endswith("\n"):
+            break
+        yield json.loads(line)
+
+
+def replay(records):
+    """
+    Plays the records back through the engine, yielding (record, game)
+    after each record is applied, a restore record replaces the game with
+    its snapshot.  Finished games are dropped so only
+    unfinished games are held in memory.  Raises ValueError if a move in
+    the log is refused by the engine
+    """
+    games = {}
+
+    for record in records:
+        game_id = record["game"]
+
+        if record["type"] == "game":
+            deck = create_deck(record["seed"])
+            deck.shuffle()
+            players = [Player(name) for name in record["players"]]
+            game = Game(players, record["cards"], deck,
+                    record["starting_player"])
+            games[game_id] = game
+        elif record["type"] == "restore":
+            game = load_game(base64.b64decode(record["snapshot"]))
+            games[game_id] = game
+        else:
+            game = games.get(game_id)
+            if game is None:
+                raise ValueError("move for unknown game %r" % (game_id,))
+
+            play_response = game.play(record["player"],
+                    decode_move(record["move"]))
+            if not play_response.success:
+                raise ValueError("game %r move %r refused: %s" %
+                        (game_id, record["version"], play_response.message))
+
+        if game.state is GameState.FINISHED:
+            del games[game_id]
+
+        yield record, game
+
+def replay_game(records, game_id, version=None):
+    """
+    Returns the game with the given id as it was at version, or at its last
+    logged move, None if the game isn't in the log
+    """
+    found = None
+    for record, game in replay(records):
+        if record["game"] != game_id:
+            continue
+
+        found = game
+        if version is not None and game.version >= version:
+            break
+
+    return found
+
+
+def parse_args(argv=sys.argv[1:]):
+    description = """
+    Replay a bobswitch move log
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("log", help="move log to replay")
+    parser.add_argument("-g", "--game", help="print the state of this game")
+    parser.add_argument("-v", "--version", type=int, default=None,
+                    help="version of the game to print, defaults to the last")
+    parser.add_argument("-s", "--slowest", type=int, default=10,
+                    help="number of slowest moves to report")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+
+    with open(arguments.log) as log_file:
+        records = read_log(log_file)
+
+        if arguments.game is not None:
+            game = replay_game(records, arguments.game, arguments.version)
+            if game is None:
+                sys.exit("game %s not in log" % (arguments.game,))
+
+            state = convert_state_watch(game.state, game.players,
+                    game.player_hands, game.current_player,
+                    game.played_cards.active_card(), game.direction)
+            state["version"] = game.version
+            print json.dumps(state, indent=4)
+            sys.exit()
+
+        #time every record to find moves that are slow to apply
+        count = 0
+        timings = []
+        start = last = time.time()
+        for record, game in replay(records):
+            now = time.time()
+            timings.append((now - last, record["game"], record.get("version")))
+            timings = sorted(timings, reverse=True)[:arguments.slowest]
+            last = now
+            count = count + 1
+
+        print json.dumps({
+            "records": count,
+            "seconds": time.time() - start,
+            "slowest": timings
+        }, indent=4)
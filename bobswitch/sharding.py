@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+    Sharding
+    ~~~~~~~~~~~~
+
+    Spreads rooms over several server processes.  Every room name hashes to
+    exactly one worker so all the players and spectators of a room end up in
+    the same process.
+
+    Clients connect to a front process speaking the normal protocol.  The
+    front reads the room from each account:listing and passes the client's
+    messages to the worker that owns the room over a websocket, and the
+    worker's messages back, so clients never see the workers.
+"""
+
+import zlib
+from functools import partial
+
+import tornado.web
+import tornado.ioloop
+from tornado.websocket import websocket_connect
+import sockjs.tornado
+
+import config
+from codec import get_codec
+
+import logging
+log = logging.getLogger()
+
+
+def shard_for_room(room_name, shards):
+    """
+    Returns the index of the worker that owns the room, the hash is stable
+    across processes and restarts unlike the builtin hash
+    """
+    if isinstance(room_name, unicode):
+        room_name = room_name.encode("utf-8")
+
+    return (zlib.crc32(room_name) & 0xffffffff) % shards
+
+
+class Shard(object):
+    """
+    Describes the worker running in this process and where its siblings 
+    listen, worker n listens on base_port + n
+    """
+
+    def __init__(self, index, shards, base_port):
+        self.index = index
+        self.shards = shards
+        self.base_port = base_port
+
+    def owns(self, room_name):
+        return shard_for_room(room_name, self.shards) == self.index
+
+    def worker_port(self, index):
+        return self.base_port + index
+
+    def describe(self, room_name):
+        """
+        Returns the location of the worker for the room as sent to clients
+        """
+        index = shard_for_room(room_name, self.shards)
+
+        return {
+            "room": room_name,
+            "shard": index,
+            "port": self.worker_port(index)
+        }
+
+    def __repr__(self):
+        return "Shard: %r of %r" % (self.index, self.shards)
+
+
+def front_application(shard):
+    """
+    Returns the Application of the front process for the workers
+    """
+    router = sockjs.tornado.SockJSRouter(ShardProxyConnection, "/bobswitch")
+
+    return tornado.web.Application(router.urls + [
+        (r"/shard", ShardRouterHandler, {"shard": shard}),
+    ])
+
+
+class ShardRouterHandler(tornado.web.RequestHandler):
+    """
+    Answers GET /shard?room=name with the worker serving that room
+    """
+
+    def initialize(self, shard):
+        self.shard = shard
+
+    def get(self):
+        room_name = self.get_argument("room")
+
+        self.write(self.shard.describe(room_name))
+
+
+class ShardProxyConnection(sockjs.tornado.SockJSConnection):
+    """
+    Client connection to the front process.  The client's messages are 
+    passed on, unchanged, to the worker owning the room of its last
+    account:listing, messages before the first listing go to worker 0.  
+    When a listing names a room owned by another worker the connection to 
+    the old worker is closed, as if the client had disconnected, and the 
+    events in ``setup_events`` the client has sent are sent again to the 
+    new worker before the listing so the connection keeps its settings.
+    The worker confirms them again.
+    """
+
+    codec = get_codec(config.JSON_CODEC)
+
+    #Shard describing the workers, set before the front starts
+    shard = None
+
+    host = "127.0.0.1"
+    path = "/bobswitch/websocket"
+
+    io_loop = None
+
+    #events that set up the connection rather than act on a room
+    setup_events = ("connection:protocol", "connection:batch", 
+            "game:state:deltas")
+
+    def on_open(self, info):
+        self.upstream = None
+        self.upstream_index = None
+        #messages waiting for the worker connection to open
+        self.pending = []
+        #setup event name to the last message sent for it
+        self.setup = {}
+        #bumped whenever the worker connection is replaced so callbacks
+        #for an old connection are ignored
+        self.generation = 0
+
+    def get_io_loop(self):
+        return self.io_loop or tornado.ioloop.IOLoop.instance()
+
+    def on_message(self, message):
+        name = room = None
+        try:
+            decoded_json = self.codec.decode(message)
+            name = decoded_json.get("name")
+            room = decoded_json.get("room")
+        except (ValueError, TypeError, AttributeError):
+            #let the worker report bad messages
+            pass
+
+        if name == "account:listing" and isinstance(room, basestring):
+            index = shard_for_room(room, self.shard.shards)
+            if index != self.upstream_index:
+                self.connect(index)
+        elif self.upstream_index is None:
+            self.connect(0)
+
+        self.forward(message)
+
+        if name in self.setup_events:
+            self.setup[name] = message
+
+    def connect(self, index):
+        self.close_upstream()
+        self.upstream_index = index
+        self.pending = [self.setup[name] for name in self.setup_events 
+                if name in self.setup]
+
+        self.open_upstream(index).add_done_callback(
+                partial(self.on_upstream_open, self.generation))
+
+    def open_upstream(self, index):
+        """
+        Returns a Future of the websocket connection to the worker
+        """
+        return websocket_connect("ws://%s:%d%s" % (self.host, 
+            self.shard.worker_port(index), self.path), self.get_io_loop())
+
+    def close_upstream(self):
+        self.generation = self.generation + 1
+        if self.upstream is not None:
+            self.upstream.protocol.close()
+            self.upstream = None
+
+    def forward(self, message):
+        if self.upstream is not None:
+            self.upstream.write_message(message)
+        else:
+            self.pending.append(message)
+
+    def on_upstream_open(self, generation, future):
+        try:
+            upstream = future.result()
+        except Exception:
+            if generation == self.generation:
+                log.exception("failed to connect to worker %d", 
+                        self.upstream_index)
+                self.close()
+            return
+
+        if generation != self.generation or self.is_closed:
+            upstream.protocol.close()
+            return
+
+        self.upstream = upstream
+        for message in self.pending:
+            upstream.write_message(message)
+        self.pending = []
+
+        upstream.read_message(partial(self.on_upstream_message, generation))
+
+    def on_upstream_message(self, generation, future):
+        if generation != self.generation:
+            return
+
+        message = future.result()
+        if message is None:
+            #the worker went away, the client reconnects as it would to a 
+            #single server
+            self.upstream = None
+            self.close()
+            return
+
+        self.send(message)
+        self.upstream.read_message(
+                partial(self.on_upstream_message, generation))
+
+    def on_close(self):
+        self.close_upstream()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+    Simulator
+    ~~~~~~~~~~~~
+
+    Headless runner that plays complete games of switch between bot
+    policies, spread over a multiprocessing pool.  Reports win rates, game
+    length and the number of times the deck had to be reshuffled, useful
+    for rule balance and for modelling server load.
+"""
+
+import sys
+import json
+import random
+import argparse
+import multiprocessing
+
+from engine import create_deck, Game, GameState, MoveType
+from models import Player, Rank, SUITS, SUIT_MASKS
+
+
+def best_suit(hand):
+    """
+    Returns the suit the hand holds the most cards of
+    """
+    counts = [bin(hand.mask & mask).count("1") for mask in SUIT_MASKS]
+    return SUITS[counts.index(max(counts))]
+
+
+def random_policy(game, player_name, moves, rand):
+    """
+    Chooses any of the legal moves at random, aces change to a random suit
+    """
+    move = rand.choice(moves)
+    if move.move_type is MoveType.play and move.card.rank is Rank.ace:
+        move.suit = rand.choice(SUITS)
+
+    return move
+
+
+def first_policy(game, player_name, moves, rand):
+    """
+    Always takes the first legal move, aces change to the suit the player
+    holds the most of
+    """
+    move = moves[0]
+    if move.move_type is MoveType.play and move.card.rank is Rank.ace:
+        move.suit = best_suit(game.player_hand(player_name))
+
+    return move
+
+
+POLICIES = {
+    "random": random_policy,
+    "first": first_policy,
+}
+
+
+class GameResult(object):
+    """
+    Outcome of a single simulated game, winner is the seat index of the
+    winning player or None if the game stalled
+    """
+
+    def __init__(self, winner, moves, reshuffles):
+        self.winner = winner
+        self.moves = moves
+        self.reshuffles = reshuffles
+
+
+def simulate_game(seed, policy_names, number_of_cards=7, max_moves=5000):
+    """
+    Plays a single game to the end with one policy per seat and returns
+    a GameResult.  Games that exceed max_moves are treated as stalled
+    """
+    rand = random.Random(seed)
+    policies = [POLICIES[name] for name in policy_names]
+    players = [Player("bot%d" % (seat + 1,)) for seat in xrange(len(policies))]
+
+    deck = create_deck(seed)
+    deck.shuffle()
+
+    game = Game(players, number_of_cards, deck)
+
+    moves = 0
+    while game.state is not GameState.FINISHED and moves < max_moves:
+        seat = game.current_player - 1
+        player_name = players[seat].name
+
+        legal = game.legal_moves(player_name)
+        move = policies[seat](game, player_name, legal, rand)
+
+        play_response = game.play(player_name, move)
+        if not play_response.success:
+            raise ValueError("policy %r made an invalid move: %s" %
+                    (policy_names[seat], play_response.message))
+
+        moves = moves + 1
+
+    winner = None
+    if game.state is GameState.FINISHED:
+        winner = game.current_player - 1
+
+    return GameResult(winner, moves, game.reshuffles)
+
+
+class SimulationReport(object):
+    """
+    Aggregated results of a batch of simulated games
+    """
+
+    def __init__(self, number_of_players):
+        self.games = 0
+        self.stalled = 0
+        self.wins = [0] * number_of_players
+        self.moves = 0
+        self.min_moves = None
+        self.max_moves = 0
+        self.reshuffles = 0
+        self.reshuffled_games = 0
+
+    def add_result(self, result):
+        self.games = self.games + 1
+        if result.winner is None:
+            self.stalled = self.stalled + 1
+        else:
+            self.wins[result.winner] = self.wins[result.winner] + 1
+
+        self.moves = self.moves + result.moves
+        if self.min_moves is None or result.moves < self.min_moves:
+            self.min_moves = result.moves
+        self.max_moves = max(self.max_moves, result.moves)
+
+        self.reshuffles = self.reshuffles + result.reshuffles
+        if result.reshuffles:
+            self.reshuffled_games = self.reshuffled_games + 1
+
+    def merge(self, other):
+        """
+        Adds the results of another report into this one
+        """
+        self.games = self.games + other.games
+        self.stalled = self.stalled + other.stalled
+        self.wins = [a + b for a, b in zip(self.wins, other.wins)]
+        self.moves = self.moves + other.moves
+        if other.min_moves is not None and (self.min_moves is None
+                or other.min_moves < self.min_moves):
+            self.min_moves = other.min_moves
+        self.max_moves = max(self.max_moves, other.max_moves)
+        self.reshuffles = self.reshuffles + other.reshuffles
+        self.reshuffled_games = self.reshuffled_games + other.reshuffled_games
+
+    def win_rates(self):
+        if not self.games:
+            return [0.0] * len(self.wins)
+
+        return [float(wins) / self.games for wins in self.wins]
+
+    def average_moves(self):
+        if not self.games:
+            return 0.0
+
+        return float(self.moves) / self.games
+
+    def as_dict(self):
+        return {
+            "games": self.games,
+            "stalled": self.stalled,
+            "wins": self.wins,
+            "win_rates": self.win_rates(),
+            "average_moves": self.average_moves(),
+            "min_moves": self.min_moves,
+            "max_moves": self.max_moves,
+            "reshuffles": self.reshuffles,
+            "reshuffled_games": self.reshuffled_games
+        }
+
+
+def simulate_chunk(arguments):
+    """
+    Pool worker, plays the games for a range of seeds and returns the
+    aggregated report so only one object per chunk crosses processes
+    """
+    first_seed, count, policy_names, number_of_cards, max_moves = arguments
+
+    report = SimulationReport(len(policy_names))
+    for seed in xrange(first_seed, first_seed + count):
+        report.add_result(simulate_game(seed, policy_names, number_of_cards,
+            max_moves))
+
+    return report
+
+
+def run_simulations(games, policy_names, processes=None, seed=0,
+        number_of_cards=7, max_moves=5000, chunk_size=1000):
+    """
+    Plays the requested number of games using seeds seed to seed + games,
+    spread over a pool of processes (defaults to one per cpu).  When
+    processes is 1 the games are played in this process
+    """
+    chunks = [(first_seed, min(chunk_size, seed + games - first_seed),
+            policy_names, number_of_cards, max_moves)
+            for first_seed in xrange(seed, seed + games, chunk_size)]
+
+    report = SimulationReport(len(policy_names))
+
+    if processes == 1:
+        for chunk in chunks:
+            report.merge(simulate_chunk(chunk))
+        return report
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for chunk_report in pool.imap_unordered(simulate_chunk, chunks):
+            report.merge(chunk_report)
+    finally:
+        pool.close()
+        pool.join()
+
+    return report
+
+
+def parse_args(argv=sys.argv[1:]):
+    description = """
+    Simulate games of bobswitch between bot policies
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("-g", "--games", type=int, default=10000,
+                    help="number of games to play")
+    parser.add_argument("-p", "--players", default="random,random",
+                    help="comma separated policy for each seat (%s)" %
+                    (", ".join(sorted(POLICIES)),))
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                    help="number of worker processes, defaults to cpu count")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                    help="seed of the first game")
+    parser.add_argument("-c", "--cards", type=int, default=7,
+                    help="number of cards dealt to each player")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+
+    policy_names = arguments.players.split(",")
+    report = run_simulations(arguments.games, policy_names,
+            arguments.processes, arguments.seed, arguments.cards)
+
+    print json.dumps(report.as_dict(), indent=4)
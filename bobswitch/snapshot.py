@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+    Snapshot
+    ~~~~~~~~~~~~
+
+    Compact versioned binary form of a Game, used to persist rooms and move
+    them between workers.  Cards are written as their 0-51 index, one byte
+    each, so a two player game is around a hundred bytes.
+
+    The layout, all integers little endian::
+
+        magic "BSG", format version
+        flags, state, current player, accumulated count, game version,
+            reshuffles, seed
+        number of players, then for each player
+            name length, utf-8 name, played, won, hand length, hand cards
+        deck length, deck cards
+        played length, played cards, top card (255 for none)
+        declared suit id (255 for none)
+        random state if the random flag is set
+
+    The Random the deck shuffles with is only included when asked for,
+    otherwise a restored deck shuffles with a Random seeded from the seed
+    and game version so restores are still reproducible.
+"""
+
+import random
+import struct
+
+from engine import Game, GameState, GameDirection, PlayerHand
+from models import Card, Deck, Player, PlayedCards, SUITS, SUIT_IDS, \
+        NUMBER_OF_CARDS
+
+MAGIC = "BSG"
+FORMAT_VERSION = 2
+
+FLAG_FIRST_PLAY = 1
+FLAG_ANTICLOCKWISE = 2
+FLAG_SEED = 4
+FLAG_RANDOM = 8
+
+NO_CARD = 255
+NO_SUIT = 255
+
+STATES = list(GameState)
+
+HEADER = struct.Struct("<3sB")
+GAME = struct.Struct("<BBBHIHI")
+NAME_LENGTH = struct.Struct("<H")
+PLAYER = struct.Struct("<IIB")
+LENGTH = struct.Struct("<B")
+RANDOM = struct.Struct("<B625Id")
+
+STATE_IDS = dict((state, position) for position, state in enumerate(STATES))
+
+
+def dump_cards(cards):
+    return LENGTH.pack(len(cards)) + "".join(chr(card.index) for card in cards)
+
+def dump_game(game, random_state=False):
+    """
+    Returns the snapshot of the game as a byte string, the state of the
+    deck's Random is included if random_state is set
+    """
+    flags = 0
+    if game.first_play:
+        flags |= FLAG_FIRST_PLAY
+    if game.direction is GameDirection.anticlockwise:
+        flags |= FLAG_ANTICLOCKWISE
+    if game.seed is not None:
+        flags |= FLAG_SEED
+    if random_state:
+        flags |= FLAG_RANDOM
+
+    parts = [
+        HEADER.pack(MAGIC, FORMAT_VERSION),
+        GAME.pack(flags, STATE_IDS[game.state], game.current_player,
+            game.accumulated_count, game.version, game.reshuffles,
+            game.seed or 0),
+        LENGTH.pack(len(game.players))
+    ]
+
+    for player in game.players:
+        name = player.name.encode("utf-8")
+        hand = game.player_hand(player.name)
+        parts.append(NAME_LENGTH.pack(len(name)))
+        parts.append(name)
+        parts.append(PLAYER.pack(player.played, player.won, len(hand.cards)))
+        parts.append("".join(chr(card.index) for card in hand.cards))
+
+    top_card = game.played_cards.top_card
+    parts.append(dump_cards(game.deck.cards))
+    parts.append(dump_cards(game.played_cards.cards))
+    parts.append(chr(top_card.index if top_card is not None else NO_CARD))
+
+    declared_suit = game.played_cards.declared_suit
+    parts.append(chr(SUIT_IDS[declared_suit] 
+        if declared_suit is not None else NO_SUIT))
+
+    if random_state:
+        version, state, gauss_next = game.deck.random.getstate()
+        parts.append(RANDOM.pack(version, *(state + (gauss_next or 0.0,))))
+
+    return "".join(parts)
+
+
+def read_card(index):
+    if index >= NUMBER_OF_CARDS:
+        raise ValueError("invalid card %d in game snapshot" % (index,))
+    return Card.from_index(index)
+
+def read_table(table, position, name):
+    if position >= len(table):
+        raise ValueError("invalid %s %d in game snapshot" % (name, position))
+    return table[position]
+
+
+class SnapshotReader(object):
+    """
+    Reads the fields of a snapshot in order
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read(self, length):
+        end = self.offset + length
+        if end > len(self.data):
+            raise ValueError("game snapshot is truncated")
+
+        data = self.data[self.offset:end]
+        self.offset = end
+        return data
+
+    def unpack(self, structure):
+        return structure.unpack(self.read(structure.size))
+
+    def read_cards(self, length=None):
+        if length is None:
+            length, = self.unpack(LENGTH)
+        return [read_card(ord(c)) for c in self.read(length)]
+
+
+def load_game(data, players=None):
+    """
+    Returns the Game a snapshot was made from.  players is an optional dict
+    of name to Player, players found in it are used in place of new Player
+    objects so the game can share them with a room.  Raises ValueError if
+    the data isn't a snapshot this version can read
+    """
+    reader = SnapshotReader(data)
+
+    magic, format_version = reader.unpack(HEADER)
+    if magic != MAGIC:
+        raise ValueError("not a game snapshot")
+    if format_version != FORMAT_VERSION:
+        raise ValueError("unsupported game snapshot version %d" %
+                (format_version,))
+
+    (flags, state, current_player, accumulated_count, version, reshuffles,
+            seed) = reader.unpack(GAME)
+    if not flags & FLAG_SEED:
+        seed = None
+
+    game = Game.__new__(Game)
+    game.first_play = bool(flags & FLAG_FIRST_PLAY)
+    game.direction = GameDirection.clockwise
+    if flags & FLAG_ANTICLOCKWISE:
+        game.direction = GameDirection.anticlockwise
+    game.state = read_table(STATES, state, "state")
+    game.current_player = current_player
+    game.accumulated_count = accumulated_count
+    game.version = version
+    game.reshuffles = reshuffles
+    game.seed = seed
+
+    game.players = []
+    game.player_hands = {}
+    number_of_players, = reader.unpack(LENGTH)
+    for _ in xrange(number_of_players):
+        name_length, = reader.unpack(NAME_LENGTH)
+        name = reader.read(name_length).decode("utf-8")
+        played, won, hand_length = reader.unpack(PLAYER)
+
+        player = players.get(name) if players else None
+        if player is None:
+            player = Player(name)
+        player.played = played
+        player.won = won
+
+        player_hand = PlayerHand(player)
+        player_hand.hand.add_cards(reader.read_cards(hand_length))
+
+        game.players.append(player)
+        game.player_hands[name] = player_hand
+
+    deck_cards = reader.read_cards()
+    played_cards = reader.read_cards()
+    top_card, = reader.read(1)
+
+    game.played_cards = PlayedCards()
+    game.played_cards.add_cards(played_cards)
+    if ord(top_card) != NO_CARD:
+        game.played_cards.top_card = read_card(ord(top_card))
+
+    declared_suit, = reader.read(1)
+    if ord(declared_suit) != NO_SUIT:
+        game.played_cards.declared_suit = read_table(SUITS, 
+                ord(declared_suit), "suit")
+
+    if flags & FLAG_RANDOM:
+        random_fields = reader.unpack(RANDOM)
+        gauss_next = random_fields[-1] or None
+        rand = random.Random()
+        rand.setstate((random_fields[0], random_fields[1:-1], gauss_next))
+    else:
+        rand = random.Random(((seed or 0) << 32) | version)
+
+    game.deck = Deck(rand, seed)
+    game.deck.add_cards(deck_cards)
+
+    return game
@@ -12,15 +12,113 @@
 """
 
 from inspect import ismethod, getmembers
+from collections import deque
+from functools import partial
 
+import sys
+import time
+
+import tornado.ioloop
+from tornado.concurrent import Future, TracebackFuture
 import sockjs.tornado
-import json
+
+import config
+from codec import get_codec
 
 import logging
 
 logger = logging.getLogger()
 
-def event(name_or_func):
+#wire protocols a connection can negotiate, json sends each event as a keyed
+#object, compact as a [name, message] array with compact message bodies
+JSON_PROTOCOL = "json"
+COMPACT_PROTOCOL = "compact"
+PROTOCOLS = (JSON_PROTOCOL, COMPACT_PROTOCOL)
+
+class MessageError(ValueError):
+    """Raised when a message doesn't match its event's schema"""
+
+
+class Optional(object):
+    """Marks a key of a dict schema as optional"""
+
+    def __init__(self, schema):
+        self.schema = schema
+
+
+def compile_schema(schema):
+    """
+    Returns a function that checks a message against the schema and returns
+    it converted, raising MessageError if it doesn't match.
+
+    A schema is None for any message, a type or tuple of types, a dict of 
+    key to schema for an object with those keys, a list holding the schema 
+    of every item, or a function that converts the message and raises 
+    ValueError, TypeError or KeyError for bad messages.
+    """
+    if schema is None:
+        return lambda value: value
+
+    if isinstance(schema, dict):
+        fields = []
+        for key, field in schema.items():
+            optional = isinstance(field, Optional)
+            if optional:
+                field = field.schema
+            fields.append((key, optional, compile_schema(field)))
+
+        def validate_dict(value):
+            if not isinstance(value, dict):
+                raise MessageError("expected an object")
+
+            converted = {}
+            for key, optional, validate in fields:
+                if key in value:
+                    converted[key] = validate(value[key])
+                elif not optional:
+                    raise MessageError("missing %r" % (key,))
+            return converted
+
+        return validate_dict
+
+    if isinstance(schema, list):
+        validate_item = compile_schema(schema[0])
+
+        def validate_list(value):
+            if not isinstance(value, list):
+                raise MessageError("expected an array")
+            return [validate_item(item) for item in value]
+
+        return validate_list
+
+    if isinstance(schema, (type, tuple)):
+        types = schema if isinstance(schema, tuple) else (schema,)
+        #bool is an int but true isn't a number in a message
+        allow_bool = bool in types
+
+        def validate_type(value):
+            if (not isinstance(value, types) 
+                    or (isinstance(value, bool) and not allow_bool)):
+                raise MessageError("expected %s not %s" % 
+                        ("/".join(t.__name__ for t in types), 
+                            type(value).__name__))
+            return value
+
+        return validate_type
+
+    if callable(schema):
+        def convert(value):
+            try:
+                return schema(value)
+            except (ValueError, TypeError, KeyError), e:
+                raise MessageError(str(e))
+
+        return convert
+
+    raise TypeError("invalid schema %r" % (schema,))
+
+
+def event(name_or_func, schema=None):
     """Event handler decorator.
 
     Can be used with event name or will automatically use function name
@@ -35,6 +133,14 @@ def event(name_or_func):
         @event
         def baz(self):
             pass
+
+    A schema, see compile_schema, checks and converts the message before 
+    the handler is called::
+
+        # Will handle 'chat' events with a string message
+        @event('chat', schema=basestring)
+        def chat(self, room, message):
+            pass
     """
 
     if callable(name_or_func):
@@ -43,11 +149,77 @@ def event(name_or_func):
 
     def handler(f):
         f._event_name = name_or_func
+        f._event_schema = schema
         return f
 
     return handler
 
 
+class SerialExecutor(object):
+    """
+    Runs calls one at a time in the order they are submitted.  A call that 
+    returns a Future, such as a ``gen.coroutine`` handler, holds back the 
+    calls after it until the Future resolves.  on_idle is called whenever 
+    the last queued call finishes
+    """
+
+    def __init__(self, io_loop=None, on_idle=None):
+        self.io_loop = io_loop
+        self.on_idle = on_idle
+        self.calls = deque()
+        self.running = False
+
+    def submit(self, func, *args):
+        """
+        Queues the call, running it straight away if nothing is queued, and 
+        returns a Future of its result
+        """
+        future = TracebackFuture()
+        self.calls.append((future, func, args))
+
+        if not self.running:
+            self.run()
+
+        return future
+
+    def run(self):
+        self.running = True
+
+        while self.calls:
+            future, func, args = self.calls.popleft()
+            try:
+                result = func(*args)
+            except Exception:
+                logger.exception("Error in %r" % (func,))
+                future.set_exc_info(sys.exc_info())
+                continue
+
+            if not isinstance(result, Future):
+                future.set_result(result)
+            elif result.done():
+                #a coroutine that never yielded needn't wait for the IOLoop
+                self.copy_result(result, future)
+            else:
+                io_loop = self.io_loop or tornado.ioloop.IOLoop.instance()
+                io_loop.add_future(result, partial(self.resume, future))
+                return
+
+        self.running = False
+        if self.on_idle is not None:
+            self.on_idle(self)
+
+    def copy_result(self, result, future):
+        try:
+            future.set_result(result.result())
+        except Exception:
+            logger.exception("Error in coroutine")
+            future.set_exc_info(sys.exc_info())
+
+    def resume(self, future, result):
+        self.copy_result(result, future)
+        self.run()
+
+
 class EventMagicMeta(type):
     """Event handler metaclass"""
     def __init__(cls, name, bases, attrs):
@@ -56,6 +228,11 @@ class EventMagicMeta(type):
         events = [(e._event_name, e) for _, e in getmembers(cls, is_event)]
         setattr(cls, '_events', dict(events))
 
+        # compile the schemas once for the class
+        validators = [(e._event_name, compile_schema(e._event_schema)) 
+                for _, e in events if getattr(e, '_event_schema', None)]
+        setattr(cls, '_validators', dict(validators))
+
         # Call base
         super(EventMagicMeta, cls).__init__(name, bases, attrs)
 
@@ -73,35 +250,147 @@ class EventSocketConnection(sockjs.tornado.SockJSConnection):
 
         sock.emit('test', {msg:'Hello World'});
 
+    Connections start on the json protocol and can switch to the compact
+    protocol by sending a ``connection:protocol`` event.
+
+    Events for a client that isn't keeping up, one whose sockjs session is
+    holding config.OUTBOX_BACKLOG_BYTES of unsent messages, wait in an 
+    outbox of at most config.OUTBOX_LIMIT events.  An event named in 
+    ``superseded_events`` replaces the queued events it makes out of date.
+
+    Connections that send a ``connection:batch`` event have all the events
+    for them from one IOLoop iteration sent as a single frame, an array of
+    events in the connections protocol wrapped in a batch event for json.
+
+    Handlers may be coroutines.  Events for a room are run in order by that
+    room's SerialExecutor, shared by every connection, so a coroutine holds
+    back later events for its room while other rooms carry on.  Events 
+    without a room are run in order per connection.  The room an event 
+    runs in is picked by ``executor_key``, the room the client named unless
+    overridden.
     """
     __metaclass__ = EventMagicMeta
 
-    def on_message(self, message):
-        decoded_json = json.loads(message)
-        name = decoded_json["name"];
-        room = decoded_json["room"] if "room" in decoded_json else None;
-        handler = self._events.get(name)
+    codec = get_codec(config.JSON_CODEC)
+
+    protocol = JSON_PROTOCOL
+
+    batching = False
+
+    #event name to the names of queued events it replaces
+    superseded_events = {}
+
+    #IOLoop the outbox is drained on, the global instance if not set
+    io_loop = None
+
+    #executor key to the SerialExecutor running its events, shared by every
+    #connection and dropped once the key has nothing queued
+    room_executors = {}
 
-        if handler:
-            message = None
-            if "message" in decoded_json:
-                message = decoded_json["message"]
+    def __init__(self, session):
+        super(EventSocketConnection, self).__init__(session)
 
-            return handler(self, room, message)
+        self.outbox = []
+        self.drain_timeout = None
+
+        #events waiting for the end of the IOLoop iteration when batching
+        self.batch = []
+        self.batch_scheduled = False
+
+        #runs the events sent without a room
+        self.executor = SerialExecutor(self.io_loop)
+
+    @event("connection:protocol", schema=basestring)
+    def select_protocol(self, room, protocol):
+        """
+        Switches the protocol used for events sent to this connection, the
+        reply is sent using the selected protocol
+        """
+        if protocol not in PROTOCOLS:
+            logger.error('Invalid protocol: %s' % protocol)
         else:
+            self.protocol = protocol
+
+        self.send_event("connection:protocol", self.protocol)
+
+    @event("connection:batch", schema=(bool, int))
+    def select_batching(self, room, enabled):
+        """
+        Turns batching of events on or off, the reply is sent as part of
+        the first batch
+        """
+        self.batching = bool(enabled)
+
+        self.send_event("connection:batch", self.batching)
+
+    def is_compact(self):
+        return self.protocol == COMPACT_PROTOCOL
+
+    def on_message(self, message):
+        try:
+            decoded_json = self.codec.decode(message)
+            name = decoded_json["name"]
+            room = decoded_json.get("room")
+        except (ValueError, TypeError, KeyError, AttributeError):
+            logger.error('Invalid message: %r' % (message[:100],))
+            return
+
+        if not isinstance(name, basestring):
+            logger.error('Invalid event name: %r' % (name,))
+            return
+
+        handler = self._events.get(name)
+        if handler is None:
             logger.error('Invalid event name: %s' % name)
+            return
 
-    def send_event(self, name, message):
+        if room is not None and not isinstance(room, basestring):
+            logger.error('Invalid room for %s: %r' % (name, room))
+            return
 
-        data = {
-            "type": "event",
-            "name": name,
-            "message": message
-        }
+        message = decoded_json.get("message")
+        validate = self._validators.get(name)
+        if validate is not None:
+            try:
+                message = validate(message)
+            except MessageError, e:
+                logger.error('Invalid %s message: %s' % (name, e))
+                return
+
+        return self.get_executor(room).submit(handler, self, room, message)
+
+    def executor_key(self, room):
+        """
+        Returns the key of the executor an event sent to the room runs on,
+        events with the same key run in order and None runs them in order
+        for this connection alone.  Connections that track which room they 
+        are in should key on that rather than trust the client
+        """
+        return room
+
+    def get_executor(self, room):
+        """
+        Returns the SerialExecutor for events sent to the room
+        """
+        key = self.executor_key(room)
+        if key is None:
+            return self.executor
 
-        self.send(json.dumps(data))
+        executor = self.room_executors.get(key)
+        if executor is None:
+            executor = SerialExecutor(self.io_loop, 
+                    partial(self.release_executor, key))
+            self.room_executors[key] = executor
 
-    def broadcast_event(self, participants, name, message):
+        return executor
+
+    def release_executor(self, key, executor):
+        if self.room_executors.get(key) is executor:
+            del self.room_executors[key]
+
+    def encode_event(self, name, message, protocol=JSON_PROTOCOL):
+        if protocol == COMPACT_PROTOCOL:
+            return self.codec.encode([name, message])
 
         data = {
             "type": "event",
@@ -109,4 +398,164 @@ class EventSocketConnection(sockjs.tornado.SockJSConnection):
             "message": message
         }
 
-        self.broadcast(participants, json.dumps(data))
+        return self.codec.encode(data)
+
+    def encode_batch(self, events):
+        """
+        Returns a frame of encoded events, they are joined without decoding
+        so the codec must produce json
+        """
+        if self.protocol == COMPACT_PROTOCOL:
+            return "[%s]" % (",".join(events),)
+
+        return '{"type":"batch","events":[%s]}' % (",".join(events),)
+
+    def send_event(self, name, message):
+        """
+        Sends an event to this connection, message must already be in the 
+        form for the connections protocol
+        """
+        self.queue_event(name, self.encode_event(name, message, self.protocol))
+
+    def get_io_loop(self):
+        return self.io_loop or tornado.ioloop.IOLoop.instance()
+
+    def queue_event(self, name, data):
+        """
+        Sends the encoded event, or adds it to the batch sent at the end of
+        this IOLoop iteration
+        """
+        if not self.batching:
+            self.write_event(name, data)
+            return
+
+        self.batch = self.remove_superseded(self.batch, name)
+        self.batch.append((name, data))
+
+        if not self.batch_scheduled:
+            self.batch_scheduled = True
+            self.get_io_loop().add_callback(self.flush_batch)
+
+    def flush_batch(self):
+        self.batch_scheduled = False
+        batch = self.batch
+        self.batch = []
+
+        if not batch or self.is_closed:
+            return
+
+        if len(batch) == 1:
+            name, data = batch[0]
+            self.write_event(name, data)
+        else:
+            self.write_event(None, 
+                    self.encode_batch([data for name, data in batch]))
+
+    def remove_superseded(self, events, name):
+        """
+        Returns the queued events without those made out of date by name
+        """
+        superseded = self.superseded_events.get(name)
+        if not superseded:
+            return events
+
+        return [(queued_name, queued_data) 
+                for queued_name, queued_data in events
+                if queued_name not in superseded]
+
+    def pending_bytes(self):
+        """
+        Returns the size of the messages sockjs holds for the client, they
+        build up while a polling client is between requests
+        """
+        return len(getattr(self.session, "send_queue", ""))
+
+    def backed_up(self):
+        return (bool(self.outbox) 
+                or self.pending_bytes() >= config.OUTBOX_BACKLOG_BYTES)
+
+    def write_event(self, name, data):
+        """
+        Sends the encoded event straight away unless the client is backed 
+        up, then it waits in the outbox.  name is None for a batch
+        """
+        if not self.backed_up():
+            self.send(data)
+            return
+
+        self.outbox = self.remove_superseded(self.outbox, name)
+        self.outbox.append((name, data))
+
+        if len(self.outbox) > config.OUTBOX_LIMIT:
+            if config.OUTBOX_DISCONNECT_SLOW:
+                logger.warning("closing slow connection, %d events queued",
+                        len(self.outbox))
+                self.outbox = []
+                self.close()
+                return
+
+            del self.outbox[0]
+
+        self.schedule_drain()
+
+    def schedule_drain(self):
+        if self.drain_timeout is None:
+            self.drain_timeout = self.get_io_loop().add_timeout(
+                    time.time() + config.OUTBOX_DRAIN_INTERVAL, 
+                    self.drain_outbox)
+
+    def drain_outbox(self):
+        """
+        Sends queued events until the client backs up again
+        """
+        self.drain_timeout = None
+        if self.is_closed:
+            self.outbox = []
+            return
+
+        while (self.outbox and 
+                self.pending_bytes() < config.OUTBOX_BACKLOG_BYTES):
+            name, data = self.outbox.pop(0)
+            self.send(data)
+
+        if self.outbox:
+            self.schedule_drain()
+
+    def broadcast_event(self, participants, name, message, compact_message=None):
+        """
+        Sends an event to all the participants, encoding it once per 
+        protocol in use.  Compact connections are sent compact_message if 
+        given otherwise message
+        """
+        json_participants = []
+        compact_participants = []
+        for participant in participants:
+            if participant.protocol == COMPACT_PROTOCOL:
+                compact_participants.append(participant)
+            else:
+                json_participants.append(participant)
+
+        if json_participants:
+            self.broadcast_encoded(json_participants, name,
+                    self.encode_event(name, message))
+
+        if compact_participants:
+            if compact_message is None:
+                compact_message = message
+            self.broadcast_encoded(compact_participants, name,
+                    self.encode_event(name, compact_message, COMPACT_PROTOCOL))
+
+    def broadcast_encoded(self, participants, name, data):
+        """
+        Broadcasts the encoded event to the participants keeping up, and 
+        queues it for those batching or backed up
+        """
+        ready = []
+        for participant in participants:
+            if participant.batching or participant.backed_up():
+                participant.queue_event(name, data)
+            else:
+                ready.append(participant)
+
+        if ready:
+            self.broadcast(ready, data)
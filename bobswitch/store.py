@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+    Store
+    ~~~~~~~~~~~~
+
+    Keeps a copy of every room and its active game outside the process so
+    games survive a server restart.  Rooms are encoded on the IOLoop when
+    they change, the writes themselves are batched and done on a writer
+    thread so a slow disk never blocks the game.
+"""
+
+import time
+import Queue
+import struct
+import sqlite3
+import threading
+
+import tornado.ioloop
+
+from models import Player
+from snapshot import dump_game, load_game, SnapshotReader, NAME_LENGTH
+
+import logging
+log = logging.getLogger()
+
+
+#room records are a format version and the room's players followed by the
+#snapshot of the active game, if there is one
+ROOM_FORMAT_VERSION = 1
+
+ROOM_HEADER = struct.Struct("<BB")
+ROOM_PLAYER = struct.Struct("<IIB")
+
+def encode_room(room):
+    """
+    Returns the persistent part of a room as bytes, connected sockets and
+    cached state are left out
+    """
+    parts = [ROOM_HEADER.pack(ROOM_FORMAT_VERSION, len(room.players))]
+    for name, room_player in room.players.items():
+        player = room_player.player
+        name = name.encode("utf-8")
+        parts.append(NAME_LENGTH.pack(len(name)))
+        parts.append(name)
+        parts.append(ROOM_PLAYER.pack(player.played, player.won, 
+            room_player.ready))
+
+    if room.active_game is not None:
+        parts.append(dump_game(room.active_game))
+
+    return "".join(parts)
+
+def decode_room(data):
+    """
+    Returns the record of an encoded room, a dict of the players as (name, 
+    player, ready) tuples, the names of the active players and the game.
+    The game shares the players' Player objects
+    """
+    reader = SnapshotReader(data)
+
+    format_version, number_of_players = reader.unpack(ROOM_HEADER)
+    if format_version != ROOM_FORMAT_VERSION:
+        raise ValueError("unsupported room version %d" % (format_version,))
+
+    players = []
+    for _ in xrange(number_of_players):
+        name_length, = reader.unpack(NAME_LENGTH)
+        name = reader.read(name_length).decode("utf-8")
+        played, won, ready = reader.unpack(ROOM_PLAYER)
+
+        player = Player(name)
+        player.played = played
+        player.won = won
+        players.append((name, player, bool(ready)))
+
+    game = None
+    active_players = []
+    if reader.offset < len(data):
+        game = load_game(data[reader.offset:], 
+                dict((name, player) for name, player, _ in players))
+        active_players = [player.name for player in game.players]
+
+    return {
+        "players": players,
+        "active_players": active_players,
+        "game": game
+    }
+
+
+class RoomStore(object):
+    """
+    Interface for room storage, keeps nothing.  The default store so rooms
+    aren't encoded unless something will read them
+    """
+
+    def load_rooms(self):
+        """
+        Returns a dict of room name to encoded room for every stored room
+        """
+        return {}
+
+    def save_room(self, name, room):
+        pass
+
+    def delete_room(self, name):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryRoomStore(RoomStore):
+    """
+    Keeps the encoded rooms in a dict.  Rooms only live as long as the 
+    process but are encoded the same way as the persistent stores
+    """
+
+    def __init__(self):
+        self.rooms = {}
+
+    def load_rooms(self):
+        return dict(self.rooms)
+
+    def save_room(self, name, room):
+        self.rooms[name] = encode_room(room)
+
+    def delete_room(self, name):
+        self.rooms.pop(name, None)
+
+
+class SqliteRoomStore(RoomStore):
+    """
+    Stores rooms in an SQLite database.  Changed rooms are collected and 
+    written flush_interval seconds after the first change, each room is 
+    encoded once when the batch is flushed however often it changed.
+    With no flush_interval every change is handed to the writer straight away
+    """
+
+    def __init__(self, path, flush_interval=0.5, io_loop=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.io_loop = io_loop
+
+        #room name to changed room, or None to delete it
+        self.pending = {}
+        self.flush_timeout = None
+
+        connection = self.connect()
+        connection.execute("CREATE TABLE IF NOT EXISTS rooms "
+                "(name TEXT PRIMARY KEY, data BLOB, updated REAL)")
+        connection.commit()
+        connection.close()
+
+        self.batches = Queue.Queue()
+        self.writer = threading.Thread(target=self.write_batches)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def load_rooms(self):
+        connection = self.connect()
+        try:
+            rows = connection.execute("SELECT name, data FROM rooms")
+            return dict((name, str(data)) for name, data in rows)
+        finally:
+            connection.close()
+
+    def save_room(self, name, room):
+        self.pending[name] = room
+        self.schedule_flush()
+
+    def delete_room(self, name):
+        self.pending[name] = None
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.flush_interval is None:
+            self.flush()
+            return
+
+        if self.flush_timeout is None:
+            io_loop = self.io_loop or tornado.ioloop.IOLoop.instance()
+            self.flush_timeout = io_loop.add_timeout(
+                    time.time() + self.flush_interval, self.flush)
+
+    def flush(self):
+        """
+        Encodes the changed rooms and hands them to the writer thread
+        """
+        self.flush_timeout = None
+
+        if not self.pending:
+            return
+
+        batch = {}
+        for name, room in self.pending.items():
+            if room is None:
+                batch[name] = None
+                continue
+
+            try:
+                batch[name] = encode_room(room)
+            except Exception:
+                log.exception("failed to encode room %s", name)
+
+        self.pending = {}
+        self.batches.put(batch)
+
+    def close(self):
+        """
+        Writes everything pending and stops the writer thread
+        """
+        self.flush()
+        self.batches.put(None)
+        self.writer.join()
+
+    def write_batches(self):
+        connection = self.connect()
+
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                break
+
+            updated = time.time()
+            try:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO rooms VALUES (?, ?, ?)",
+                    [(name, sqlite3.Binary(data), updated)
+                        for name, data in batch.items() if data is not None])
+                connection.executemany("DELETE FROM rooms WHERE name = ?",
+                    [(name,) for name, data in batch.items() if data is None])
+                connection.commit()
+            except sqlite3.Error:
+                log.exception("failed to write %d rooms", len(batch))
+
+        connection.close()
@@ -2,10 +2,13 @@ import json
 
 from mock import MagicMock, Mock
 from unittest2 import TestCase, main, skip
+from tornado.concurrent import Future
 
 from bobswitch import engine
 from bobswitch import models 
 from bobswitch import bobswitch
+from bobswitch import sharding
+from bobswitch import store
 
 def create_test_socket(name, room):
     sc = bobswitch.SocketConnection("")
@@ -43,6 +46,17 @@ class TestMeta(TestCase):
         self.assertEquals("bob", game.players[0].name)
         self.assertEquals("scott", game.players[1].name)
 
+    def test_create_game_seeded(self):
+        players = [models.Player("bob"), models.Player("scott")]
+
+        game = bobswitch.create_game(players, 4321)
+        game2 = bobswitch.create_game(players, 4321)
+
+        self.assertEquals(4321, game.seed)
+        self.assertEquals(game.player_hand("bob").cards, 
+                game2.player_hand("bob").cards)
+        self.assertEquals(game.deck.cards, game2.deck.cards)
+
     def test_convert_move_type_pick(self):
         move_type = bobswitch.convert_move_type("pick")
         self.assertEquals(engine.MoveType.pick, move_type)
@@ -67,10 +81,98 @@ class TestMeta(TestCase):
         self.assertEquals(card.rank, models.Rank.three)
         self.assertEquals(card.suit, models.Suit.diamonds)
 
+    def test_convert_card_out_of_range(self):
+        for rank, suit in [(0, 1), (14, 1), (1, -1), (1, 4)]:
+            self.assertRaises(ValueError, bobswitch.convert_card, rank, suit)
+        self.assertRaises(ValueError, bobswitch.convert_suit, -1)
+
+    def test_parse_move_pick(self):
+        move = bobswitch.parse_move({"type": "pick"})
+
+        self.assertEquals(engine.MoveType.pick, move.move_type)
+        self.assertEquals(None, move.card)
+
+    def test_parse_move_play_ace(self):
+        move = bobswitch.parse_move({"type": "play", 
+            "card": {"rank": 1, "suit": 2}, "suit": 3})
+
+        self.assertEquals(engine.MoveType.play, move.move_type)
+        self.assertEquals(models.Card(models.Suit.diamonds, models.Rank.ace),
+                move.card)
+        self.assertEquals(models.Suit.spades, move.suit)
+
+    def test_parse_move_invalid(self):
+        for message in [{"type": "jump"}, {"type": "play"},
+                {"type": "play", "card": {"rank": 14, "suit": 0}},
+                {"type": "play", "card": {"rank": "1", "suit": 0}},
+                {"type": "play", "card": {"rank": 1, "suit": 0}, "suit": 4}]:
+            self.assertRaises((ValueError, TypeError, KeyError), 
+                    bobswitch.parse_move, message)
+
     def test_convert_suit(self):
         self.assertEquals(models.Suit.clubs, bobswitch.convert_suit(1))
         
 
+class TestRestoreRoom(TestCase):
+
+    def test_restore_room(self):
+        room = bobswitch.Room("room")
+        sc = create_test_socket("bob", room)
+        create_test_socket("scott", room)
+        room.active_players = room.players.copy()
+        room.active_game = create_test_game(["bob", "scott"])
+
+        restored = bobswitch.restore_room("room", store.encode_room(room))
+
+        self.assertEquals("room", restored.name)
+        self.assertEquals(None, restored.players["bob"].socket)
+        self.assertTrue(restored.active_players["bob"] 
+                is restored.players["bob"])
+        self.assertEquals(room.active_game.player_hand("bob").cards,
+                restored.active_game.player_hand("bob").cards)
+
+    def test_restore_room_logs_snapshot(self):
+        room = bobswitch.Room("room")
+        create_test_socket("bob", room)
+        create_test_socket("scott", room)
+        room.active_players = room.players.copy()
+        room.active_game = create_test_game(["bob", "scott"])
+        move_log = MagicMock()
+
+        restored = bobswitch.restore_room("room", store.encode_room(room),
+                move_log)
+
+        move_log.restore_game.assert_called_once_with(
+                bobswitch.game_log_id("room", restored.active_game), 
+                restored.active_game)
+
+    def test_load_rooms_skips_bad_records(self):
+        room = bobswitch.Room("room")
+        create_test_socket("bob", room)
+        room.active_players = room.players.copy()
+        room.active_game = create_test_game(["bob"])
+        data = store.encode_room(room)
+        room_store = store.MemoryRoomStore()
+        room_store.rooms = {"good": data, "truncated": data[:-10], 
+                "version": "\x09" + data[1:], "empty": ""}
+
+        rooms = bobswitch.load_rooms(room_store)
+
+        self.assertEquals(["good"], rooms.keys())
+
+    def test_load_rooms_owned_by_shard(self):
+        room_store = store.MemoryRoomStore()
+        for i in range(10):
+            room_store.save_room("room%d" % i, bobswitch.Room("room%d" % i))
+        shard = sharding.Shard(1, 2, 4500)
+
+        rooms = bobswitch.load_rooms(room_store, shard)
+
+        self.assertTrue(all(shard.owns(name) for name in rooms))
+        self.assertEquals(len(rooms) + len([name for name in 
+            room_store.load_rooms() if not shard.owns(name)]), 10)
+
+
 class TestSocketConnection(TestCase):
 
     def setUp(self):
@@ -137,6 +239,36 @@ class TestSocketConnection(TestCase):
         self.assertTrue("Scott" in names)
         self.assertTrue("bob" in names)
 
+    def test_listing_other_shard_redirects(self):
+        room = bobswitch.Room()
+        sc = create_test_socket("bob", room)
+        sc.shard = sharding.Shard(0, 2, 4500)
+        sc.redirect = True
+
+        #find a room owned by the other worker
+        room_name = next(name for name in ("room%d" % i for i in range(100))
+                if not sc.shard.owns(name))
+
+        sc.send_event = MagicMock()
+        sc.listing(room_name, None)
+
+        sc.send_event.assert_called_once_with("room:redirect",
+                {"room": room_name, "shard": 1, "port": 4501})
+        self.assertFalse(room_name in sc.rooms)
+
+    def test_listing_behind_front_not_redirected(self):
+        sc = create_test_socket("bob", bobswitch.Room())
+        sc.shard = sharding.Shard(0, 2, 4500)
+        room_name = next(name for name in ("room%d" % i for i in range(100))
+                if not sc.shard.owns(name))
+        sc.send_event = MagicMock()
+        self.addCleanup(sc.rooms.pop, room_name, None)
+
+        sc.listing(room_name, None)
+
+        self.assertEquals("players:listing", sc.send_event.call_args[0][0])
+        self.assertTrue(sc.active_room is sc.rooms[room_name])
+
     def test_two_players_ready_one_not_ready(self):
         room = bobswitch.Room()
         sc = create_test_socket("bob", room)
@@ -157,10 +289,14 @@ class TestSocketConnection(TestCase):
         sc2.broadcast_event = MagicMock()
         sc2.send_event = MagicMock()
         sc2.player_ready("room", None)
-        sc2.broadcast_event.assert_called_with(sc2.active_room.participants, 
+        sc2.broadcast_event.assert_any_call(sc2.active_room.participants, 
                 "game:player:ready", "Scott")
 
-        self.assertTrue(sc3.send_event.called)
+        args, kargs = sc2.broadcast_event.call_args
+        participants, key, state, compact_state = args
+        self.assertEquals([sc3], participants)
+        self.assertEquals("game:state:watch", key)
+        self.assertEquals(2, state["number_of_players"])
 
         self.assertTrue(sc.send_event.called)
 
@@ -206,6 +342,22 @@ class TestSocketConnection(TestCase):
         self.assertEquals(2, state["number_of_players"])
         self.assertEquals(7, len(state["hand"]))
 
+    def test_player_ready_logs_game(self):
+        room = bobswitch.Room("room")
+        sc = create_test_socket("bob", room)
+        sc2 = create_test_socket("Scott", room)
+        sc2.active_room.players["Scott"].ready = True
+        sc.broadcast_event = MagicMock()
+        sc.send_event = MagicMock()
+        sc2.send_event = MagicMock()
+        sc.move_log = MagicMock()
+
+        sc.player_ready("room", None)
+
+        game = room.active_game
+        sc.move_log.start_game.assert_called_once_with(
+                "room:%s" % (game.seed,), game, 7)
+
     def test_player_ready_only_one(self):
         sc = create_test_socket("bob", bobswitch.Room())
 
@@ -227,9 +379,9 @@ class TestSocketConnection(TestCase):
         game.play = MagicMock(return_value=engine.PlayResponse(True))
         sc.active_room.active_game = game
 
-        sc.player_move("room", {
+        sc.player_move("room", bobswitch.parse_move({
             "type": "wait",
-        })
+        }))
         
         args, kargs = sc.active_room.active_game.play.call_args
         name, move = args
@@ -255,9 +407,9 @@ class TestSocketConnection(TestCase):
         game.play = MagicMock(return_value=engine.PlayResponse(True))
         sc.active_room.active_game = game
 
-        sc.player_move("room", {
+        sc.player_move("room", bobswitch.parse_move({
             "type": "pick",
-        })
+        }))
         
         args, kargs = sc.active_room.active_game.play.call_args
         name, move = args
@@ -283,13 +435,13 @@ class TestSocketConnection(TestCase):
         game.play = MagicMock(return_value=engine.PlayResponse(True))
         sc.active_room.active_game = game
 
-        sc.player_move("room", {
+        sc.player_move("room", bobswitch.parse_move({
             "type": "play",
             "card": { 
                 "rank": 4,
                 "suit": 2
             }
-        })
+        }))
 
         args, kargs = sc.active_room.active_game.play.call_args
         name, move = args
@@ -306,6 +458,51 @@ class TestSocketConnection(TestCase):
         key, message = call_args 
         self.assertEquals("game:state:update", key) 
 
+    def test_events_ordered_by_active_room(self):
+        room = bobswitch.Room("room")
+        sc = create_test_socket("bob", room)
+        sc2 = create_test_socket("scott", room)
+        sc.io_loop = MagicMock()
+        sc.io_loop.add_future.side_effect = \
+                lambda future, callback: future.add_done_callback(callback)
+        sc2.broadcast_event = MagicMock()
+
+        pending = Future()
+        sc.get_executor("room").submit(lambda: pending)
+        sc2.on_message(json.dumps({"name": "chat:message", "room": "other",
+            "message": "hi"}))
+        sc2.on_message(json.dumps({"name": "chat:message", "message": "hi"}))
+
+        self.assertFalse(sc2.broadcast_event.called)
+
+        pending.set_result(None)
+
+        self.assertEquals(2, sc2.broadcast_event.call_count)
+        self.assertFalse(room in sc.room_executors)
+
+    def test_player_move_saves_room(self):
+        sc = create_test_socket("bob", bobswitch.Room("room"))
+        sc.active_room.active_players = sc.active_room.players.copy()
+        sc.send_event = MagicMock()
+        sc.store = MagicMock()
+
+        game = create_test_game(["bob"])
+        game.play = MagicMock(return_value=engine.PlayResponse(True))
+        sc.active_room.active_game = game
+
+        sc.player_move("room", bobswitch.parse_move({"type": "pick"}))
+
+        sc.store.save_room.assert_called_once_with("room", sc.active_room)
+
+    def test_player_move_invalid_message_rejected(self):
+        sc = create_test_socket("bob", bobswitch.Room())
+        sc.active_room.active_game = MagicMock()
+
+        sc.on_message(json.dumps({"name": "game:player:move", 
+            "message": {"type": "play", "card": {"rank": 20}}}))
+
+        self.assertFalse(sc.active_room.active_game.play.called)
+
     def test_player_move_fail(self):
         sc = create_test_socket("bob", bobswitch.Room())
         sc.active_room.active_players = sc.active_room.players.copy()
@@ -316,15 +513,211 @@ class TestSocketConnection(TestCase):
         game.play = MagicMock(return_value=engine.PlayResponse(False))
         sc.active_room.active_game = game
 
-        sc.player_move("room", {
+        sc.player_move("room", bobswitch.parse_move({
             "type": "wait",
             "card": { 
                 "rank": 4,
                 "suit": 2
             }
-        })
+        }))
 
         args, kargs = sc.send_event.call_args
         key, state = args
         self.assertEquals("game:player:response", key) 
-        self.assertEquals(False, state["success"]) 
+        self.assertEquals(False, state["success"])
+
+    def test_player_move_broadcasts_to_spectators(self):
+        room = bobswitch.Room()
+        sc = create_test_socket("bob", room)
+        room.active_players = room.players.copy()
+
+        sc2 = bobswitch.SocketConnection("")
+        sc2.on_open(None)
+        sc2.name = "watcher"
+        room.participants.add(sc2)
+        sc3 = bobswitch.SocketConnection("")
+        sc3.on_open(None)
+        room.participants.add(sc3)
+
+        sc.send_event = MagicMock()
+        sc.broadcast_event = MagicMock()
+
+        game = create_test_game(["bob"])
+        game.play = MagicMock(return_value=engine.PlayResponse(True))
+        room.active_game = game
+
+        sc.player_move("room", bobswitch.parse_move({
+            "type": "wait",
+        }))
+
+        args, kargs = sc.broadcast_event.call_args
+        participants, key, state, compact_state = args
+        self.assertEquals(set([sc2, sc3]), set(participants))
+        self.assertEquals("game:state:watch", key)
+        self.assertFalse("hand" in state)
+        self.assertEquals(None, compact_state)
+
+    def test_player_move_compact(self):
+        sc = create_test_socket("bob", bobswitch.Room())
+        sc.active_room.active_players = sc.active_room.players.copy()
+        sc.protocol = "compact"
+
+        sc.send_event = MagicMock()
+
+        game = create_test_game(["bob"])
+        game.play = MagicMock(return_value=engine.PlayResponse(True))
+        sc.active_room.active_game = game
+
+        sc.player_move("room", bobswitch.parse_move({
+            "type": "pick",
+        }))
+
+        name, call_args, c = sc.send_event.mock_calls[0]
+        key, message = call_args 
+        self.assertEquals("game:player:response", key) 
+        self.assertEquals([True, ""], message) 
+
+        name, call_args, c = sc.send_event.mock_calls[1]
+        key, message = call_args 
+        self.assertEquals("game:state:update", key) 
+        players, current_player, top_card, state, direction, hand = message
+        self.assertEquals([["bob", 7, 0, 0]], players)
+        self.assertEquals(game.played_cards.top_card.index, top_card)
+        self.assertEquals(7, len(hand))
+
+    def test_player_move_delta(self):
+        sc = create_test_socket("bob", bobswitch.Room())
+        sc.active_room.active_players = sc.active_room.players.copy()
+        sc.enable_deltas("room", True)
+
+        sc.send_event = MagicMock()
+
+        game = create_test_game(["bob", "scott"])
+        sc.active_room.active_game = game
+        sc.send_state("game:state:start", sc.active_room.state_snapshot(), True)
+
+        def pick(name, move):
+            game.version = game.version + 1
+            game.player_hand("bob").add_card(game.deck.deal_card())
+            return engine.PlayResponse(True)
+        game.play = MagicMock(side_effect=pick)
+
+        sc.player_move("room", bobswitch.parse_move({
+            "type": "wait",
+        }))
+
+        name, call_args, c = sc.send_event.mock_calls[-1]
+        key, message = call_args 
+        self.assertEquals("game:state:delta", key) 
+        self.assertEquals(0, message["base"]) 
+        self.assertEquals(1, message["seq"]) 
+        self.assertEquals(1, len(message["added"])) 
+
+    def test_player_move_no_delta_without_previous_state(self):
+        sc = create_test_socket("bob", bobswitch.Room())
+        sc.active_room.active_players = sc.active_room.players.copy()
+        sc.enable_deltas("room", True)
+
+        sc.send_event = MagicMock()
+
+        game = create_test_game(["bob"])
+        game.play = MagicMock(return_value=engine.PlayResponse(True))
+        sc.active_room.active_game = game
+
+        sc.player_move("room", bobswitch.parse_move({
+            "type": "wait",
+        }))
+
+        name, call_args, c = sc.send_event.mock_calls[-1]
+        key, message = call_args 
+        self.assertEquals("game:state:update", key) 
+
+    def test_resync(self):
+        sc = create_test_socket("bob", bobswitch.Room())
+        sc.active_room.active_players = sc.active_room.players.copy()
+        sc.enable_deltas("room", True)
+
+        sc.send_event = MagicMock()
+
+        game = create_test_game(["bob", "scott"])
+        sc.active_room.active_game = game
+        sc.send_state("game:state:start", sc.active_room.state_snapshot(), True)
+
+        sc.resync("room", None)
+
+        args, kargs = sc.send_event.call_args
+        key, state = args
+        self.assertEquals("game:state:update", key)
+        self.assertEquals(7, len(state["hand"]))
+
+
+class TestEviction(TestCase):
+
+    def setUp(self):
+        self.rooms = bobswitch.SocketConnection.rooms
+        self.store = bobswitch.SocketConnection.store
+        bobswitch.SocketConnection.rooms = {}
+        bobswitch.SocketConnection.store = MagicMock()
+
+    def tearDown(self):
+        bobswitch.SocketConnection.rooms = self.rooms
+        bobswitch.SocketConnection.store = self.store
+
+    def test_last_participant_leaving_idles_room(self):
+        room = bobswitch.Room("room")
+        sc = create_test_socket("bob", room)
+        sc.broadcast_event = MagicMock()
+
+        self.assertEquals(None, room.idle_since)
+        sc.on_close()
+
+        self.assertFalse(room.idle_since is None)
+        self.assertFalse(room.players["bob"].disconnected_since is None)
+
+    def test_listing_another_room_leaves_first(self):
+        room = bobswitch.Room("room")
+        sc = create_test_socket("bob", room)
+        sc.send_event = MagicMock()
+
+        sc.listing("other", None)
+
+        self.assertFalse(sc in room.participants)
+        self.assertFalse(room.idle_since is None)
+        self.assertTrue(sc in sc.rooms["other"].participants)
+        self.assertEquals(None, sc.rooms["other"].idle_since)
+
+    def test_evict_idle_room(self):
+        room = bobswitch.Room("room")
+        room.idle_since = 1000
+        busy = bobswitch.Room("busy")
+        bobswitch.SocketConnection.rooms.update({"room": room, "busy": busy})
+
+        bobswitch.SocketConnection.evict_idle_rooms(1000 + 
+                bobswitch.config.ROOM_IDLE_TTL - 1)
+        self.assertTrue("room" in bobswitch.SocketConnection.rooms)
+
+        bobswitch.SocketConnection.evict_idle_rooms(1000 + 
+                bobswitch.config.ROOM_IDLE_TTL)
+        self.assertEquals(["busy"], bobswitch.SocketConnection.rooms.keys())
+        bobswitch.SocketConnection.store.delete_room.assert_called_once_with(
+                "room")
+
+    def test_evict_disconnected_players(self):
+        room = bobswitch.Room("room")
+        sc = create_test_socket("bob", room)
+        sc.broadcast_event = MagicMock()
+        for name in ("scott", "sam"):
+            room.players[name] = bobswitch.RoomPlayer(name, None, 
+                    models.Player(name))
+            room.players[name].disconnected_since = 1000
+        room.active_players = {"sam": room.players["sam"]}
+        bobswitch.SocketConnection.rooms["room"] = room
+
+        bobswitch.SocketConnection.evict_idle_rooms(1000 + 
+                bobswitch.config.ROOM_IDLE_TTL)
+
+        self.assertEquals(["bob", "sam"], sorted(room.players.keys()))
+        sc.broadcast_event.assert_called_once_with(room.participants, 
+                "players:removed", "scott")
+        bobswitch.SocketConnection.store.save_room.assert_called_once_with(
+                "room", room)
@@ -0,0 +1,33 @@
+from unittest2 import TestCase, main, skip
+
+from bobswitch import codec
+
+class TestGetCodec(TestCase):
+
+    def test_json(self):
+        json_codec = codec.get_codec("json")
+
+        self.assertEquals("json", json_codec.name)
+        self.assertEquals('{"a": 1}', json_codec.encode({"a": 1}))
+        self.assertEquals({"a": 1}, json_codec.decode('{"a": 1}'))
+
+    def test_unknown_falls_back_to_json(self):
+        self.assertEquals("json", codec.get_codec("unknown").name)
+
+    def test_not_installed_falls_back_to_json(self):
+        def missing_codec():
+            raise ImportError("not installed")
+
+        original = codec.CODECS
+        codec.CODECS = [("missing", missing_codec)] + original
+        try:
+            self.assertEquals("json", codec.get_codec("missing").name)
+            self.assertNotEquals("missing", codec.get_codec("auto").name)
+        finally:
+            codec.CODECS = original
+
+    def test_auto_round_trip(self):
+        auto_codec = codec.get_codec("auto")
+
+        data = {"name": "bob", "message": [1, 2, {"rank": 3}]}
+        self.assertEquals(data, auto_codec.decode(auto_codec.encode(data)))
@@ -1,3 +1,5 @@
+import random
+
 from bobswitch import engine
 from bobswitch import models
 from unittest2 import TestCase, main, skip
@@ -25,6 +27,31 @@ class TestCreateDeck(TestCase):
         deck = engine.create_deck()
 
         self.assertEquals(52, deck.number_of_cards())
+        self.assertTrue(deck.seed is not None)
+
+    def test_create_deck_seeded(self):
+        deck = engine.create_deck(1234)
+        deck2 = engine.create_deck(1234)
+        deck.shuffle()
+        deck2.shuffle()
+
+        self.assertEquals(1234, deck.seed)
+        self.assertEquals(deck.cards, deck2.cards)
+
+    def test_create_deck_random(self):
+        deck = engine.create_deck(rand=random.Random(99))
+        deck2 = engine.create_deck(rand=random.Random(99))
+        deck.shuffle()
+        deck2.shuffle()
+
+        self.assertEquals(None, deck.seed)
+        self.assertEquals(deck.cards, deck2.cards)
+
+    def test_create_deck_seed_range(self):
+        self.assertEquals(2 ** 32 - 1, engine.create_deck(2 ** 32 - 1).seed)
+
+        for seed in (2 ** 40, -1, "abc", 1.5):
+            self.assertRaises(ValueError, engine.create_deck, seed)
 
 
 class TestDealPlayerHands(TestCase):
@@ -213,6 +240,15 @@ class TestValidPlays(TestCase):
 
         self.assertFalse(engine.valid_play(None, hand, top_card, engine.GameState.WAIT))
 
+    def test_wait_when_not_in_wait_state(self):
+        hand = engine.Hand()
+        hand.add_card(models.Card(models.Suit.clubs, models.Rank.ace))
+        hand.add_card(models.Card(models.Suit.hearts, models.Rank.three))
+
+        top_card = models.Card(models.Suit.clubs, models.Rank.four)
+
+        self.assertFalse(engine.valid_play(None, hand, top_card, engine.GameState.NORMAL))
+
     def test_play_non_two_when_in_pick_with_two(self):
         hand = engine.Hand()
         hand.add_card(models.Card(models.Suit.clubs, models.Rank.ace))
@@ -301,6 +337,182 @@ class TestValidPlays(TestCase):
 
         self.assertTrue(engine.valid_play(card, hand, top_card, engine.GameState.NORMAL))
 
+class TestLegalMoves(TestCase):
+
+    def test_normal_state(self):
+        hand = engine.Hand()
+        hand.add_card(models.Card(models.Suit.clubs, models.Rank.seven))
+        hand.add_card(models.Card(models.Suit.hearts, models.Rank.four))
+        hand.add_card(models.Card(models.Suit.hearts, models.Rank.ace))
+        hand.add_card(models.Card(models.Suit.spades, models.Rank.six))
+
+        top_card = models.Card(models.Suit.clubs, models.Rank.four)
+
+        moves = engine.legal_moves(hand, top_card, engine.GameState.NORMAL)
+
+        self.assertEquals([engine.MoveType.play] * 3, 
+                [move.move_type for move in moves])
+        self.assertEquals([hand.cards[0], hand.cards[1], hand.cards[2]],
+                [move.card for move in moves])
+
+    def test_normal_state_pick(self):
+        hand = engine.Hand()
+        hand.add_card(models.Card(models.Suit.spades, models.Rank.six))
+
+        top_card = models.Card(models.Suit.clubs, models.Rank.four)
+
+        moves = engine.legal_moves(hand, top_card, engine.GameState.NORMAL)
+
+        self.assertEquals(1, len(moves))
+        self.assertEquals(engine.MoveType.pick, moves[0].move_type)
+
+    def test_wait_state(self):
+        hand = engine.Hand()
+        hand.add_card(models.Card(models.Suit.clubs, models.Rank.seven))
+
+        top_card = models.Card(models.Suit.clubs, models.Rank.eight)
+
+        moves = engine.legal_moves(hand, top_card, engine.GameState.WAIT)
+
+        self.assertEquals(1, len(moves))
+        self.assertEquals(engine.MoveType.wait, moves[0].move_type)
+
+    def test_pick_state(self):
+        hand = engine.Hand()
+        hand.add_card(models.Card(models.Suit.clubs, models.Rank.seven))
+        hand.add_card(models.Card(models.Suit.hearts, models.Rank.two))
+
+        top_card = models.Card(models.Suit.clubs, models.Rank.two)
+
+        moves = engine.legal_moves(hand, top_card, engine.GameState.PICK)
+
+        self.assertEquals(1, len(moves))
+        self.assertEquals(hand.cards[1], moves[0].card)
+
+    def test_matches_valid_move(self):
+        """
+        Every move returned should be accepted by valid_pick/valid_play and
+        every move they accept should be returned
+        """
+        rand = random.Random(1234)
+        all_cards = [models.Card(suit, rank) 
+                for suit in models.Suit for rank in models.Rank]
+        states = [engine.GameState.NORMAL, engine.GameState.PICK, 
+                engine.GameState.WAIT]
+
+        #the top card is always an eight when waiting and a two or four 
+        #when picking
+        top_ranks = {
+            engine.GameState.NORMAL: list(models.Rank),
+            engine.GameState.PICK: [models.Rank.two, models.Rank.four],
+            engine.GameState.WAIT: [models.Rank.eight],
+        }
+
+        for _ in xrange(200):
+            state = rand.choice(states)
+            first_play = rand.random() < 0.2
+            top_card = models.Card(rand.choice(list(models.Suit)), 
+                    rand.choice(top_ranks[state]))
+
+            hand = engine.Hand()
+            hand.add_cards(rand.sample([c for c in all_cards if c.index != top_card.index], 
+                rand.randint(1, 10)))
+
+            moves = engine.legal_moves(hand, top_card, state, first_play)
+
+            expected = [c for c in hand.cards 
+                    if engine.valid_play(c, hand, top_card, state, first_play)]
+            self.assertEquals(expected, [m.card for m in moves 
+                if m.move_type == engine.MoveType.play])
+
+            has_pick = engine.MoveType.pick in [m.move_type for m in moves]
+            self.assertEquals(engine.valid_pick(hand, top_card, state, first_play), 
+                    has_pick)
+
+            has_wait = engine.MoveType.wait in [m.move_type for m in moves]
+            expected_wait = (state == engine.GameState.WAIT or first_play) \
+                    and engine.valid_play(None, hand, top_card, state, first_play)
+            self.assertEquals(expected_wait, has_wait)
+
+
+def shuffled_deck(seed):
+    deck = engine.create_deck(seed)
+    deck.shuffle()
+    return deck
+
+
+class TestTurnSummary(TestCase):
+
+    def test_matches_valid_pick_and_play(self):
+        """
+        The summary should answer every move, including cards not in the 
+        hand and waits, the same as valid_pick/valid_play
+        """
+        rand = random.Random(4321)
+        all_cards = [models.Card(suit, rank) 
+                for suit in models.Suit for rank in models.Rank]
+        states = [engine.GameState.NORMAL, engine.GameState.PICK, 
+                engine.GameState.WAIT]
+
+        for _ in xrange(200):
+            state = rand.choice(states)
+            first_play = rand.random() < 0.2
+            top_card = rand.choice(all_cards)
+
+            hand = engine.Hand()
+            hand.add_cards(rand.sample(all_cards, rand.randint(0, 10)))
+
+            summary = engine.TurnSummary(hand, top_card, state, first_play)
+
+            self.assertEquals(
+                    engine.valid_pick(hand, top_card, state, first_play),
+                    summary.valid_move(engine.GameMove(engine.MoveType.pick)))
+            self.assertEquals(
+                    engine.valid_play(None, hand, top_card, state, first_play),
+                    summary.valid_move(engine.GameMove(engine.MoveType.wait)))
+            for card in all_cards:
+                self.assertEquals(
+                    engine.valid_play(card, hand, top_card, state, first_play),
+                    summary.valid_move(engine.GameMove(engine.MoveType.play, 
+                        card)))
+
+    def test_game_reuses_summary(self):
+        game = engine.Game([models.Player("bob"), models.Player("john")], 7,
+                shuffled_deck(12))
+        player = game.players[game.current_player - 1].name
+        invalid = engine.GameMove(engine.MoveType.wait)
+
+        self.assertFalse(game.play(player, invalid).success)
+        summary = game.turn
+        self.assertFalse(game.play(player, invalid).success)
+        game.legal_moves(player)
+
+        self.assertTrue(summary is game.turn)
+
+    def test_game_summary_dropped_on_move(self):
+        game = engine.Game([models.Player("bob"), models.Player("john")], 7,
+                shuffled_deck(12))
+        player = game.players[game.current_player - 1].name
+        summary = game.turn_summary(game.player_hand(player), 
+                game.played_cards.active_card())
+
+        self.assertTrue(game.play(player, game.legal_moves(player)[0]).success)
+
+        self.assertFalse(summary is game.turn)
+
+    def test_game_summary_follows_hand_changes(self):
+        game = engine.Game([models.Player("bob"), models.Player("john")], 7,
+                shuffled_deck(12))
+        player = game.players[game.current_player - 1].name
+        hand = game.player_hand(player)
+        top_card = game.played_cards.active_card()
+        summary = game.turn_summary(hand, top_card)
+
+        hand.add_card(models.Card(models.Suit.hearts, models.Rank.ace))
+
+        self.assertFalse(summary is game.turn_summary(hand, top_card))
+
+
 class TestGame(TestCase):
 
     def test_init(self):
@@ -319,6 +531,14 @@ class TestGame(TestCase):
         self.assertEquals(4, game.deck.number_of_cards())
         self.assertEquals(models.Card(models.Suit.clubs, models.Rank.two), 
                 game.played_cards.top_card)
+        self.assertEquals(None, game.seed)
+
+    def test_init_records_seed(self):
+        players = [models.Player("bob"), models.Player("john")]
+
+        game = engine.Game(players, 2, engine.create_deck(77))
+
+        self.assertEquals(77, game.seed)
 
     def test_init_starting_player(self):
         player = models.Player("bob")
@@ -360,6 +580,7 @@ class TestGame(TestCase):
         play_response = game.play("john", None)
 
         self.assertEquals(False, play_response.success)
+        self.assertEquals(0, game.version)
 
     def test_valid_move_pick(self):
         player = models.Player("bob")
@@ -404,6 +625,7 @@ class TestGame(TestCase):
 
         self.assertTrue(play_response.success)
         self.assertEquals(3, game.player_hand("bob").number_of_cards())
+        self.assertEquals(1, game.version)
 
     def test_valid_move_pick_four(self):
         player = models.Player("bob")
@@ -588,6 +810,62 @@ class TestGame(TestCase):
 
         self.assertTrue(deck.shuffle.called)
 
+    def test_pick_many_causes_one_shuffle(self):
+        player = models.Player("bob")
+        player_two = models.Player("john")
+
+        players = [player, player_two,]
+
+        deck = models.Deck(None)
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.seven))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.six))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.five))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.four))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.three))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.two))
+        deck.shuffle = Mock(name="shuffle")
+
+        game = engine.Game(players, 2, deck)
+
+        game.played_cards.add_card(models.Card(models.Suit.hearts, models.Rank.jack))
+        game.played_cards.add_card(models.Card(models.Suit.hearts, models.Rank.queen))
+
+        hand = models.Hand()
+
+        game.pick_many(hand, 3)
+
+        self.assertEquals(3, hand.number_of_cards())
+        self.assertEquals(models.Card(models.Suit.clubs, models.Rank.seven), 
+                hand.cards[0])
+        self.assertEquals(0, deck.number_of_cards())
+        self.assertEquals(1, deck.shuffle.call_count)
+        self.assertEquals(1, game.reshuffles)
+
+    def test_pick_many_not_enough_cards(self):
+        player = models.Player("bob")
+        player_two = models.Player("john")
+
+        players = [player, player_two,]
+
+        deck = models.Deck(None)
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.six))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.five))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.four))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.three))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.two))
+        deck.shuffle = Mock(name="shuffle")
+
+        game = engine.Game(players, 2, deck)
+
+        game.played_cards.add_card(models.Card(models.Suit.hearts, models.Rank.jack))
+
+        hand = models.Hand()
+
+        game.pick_many(hand, 4)
+
+        self.assertEquals(1, hand.number_of_cards())
+        self.assertEquals(1, deck.shuffle.call_count)
+
     def test_invalid_move_play_card_not_present_in_hand(self):
         player = models.Player("bob")
         player_two = models.Player("john")
@@ -885,7 +1163,10 @@ class TestGame(TestCase):
 
         play_response = game.play("bob", move)
 
-        self.assertEquals(models.Suit.clubs, game.played_cards.top_card.suit)
+        self.assertEquals(models.Suit.diamonds, game.played_cards.top_card.suit)
+        self.assertEquals(models.Suit.clubs, game.played_cards.declared_suit)
+        self.assertEquals(models.Suit.clubs, 
+                game.played_cards.active_card().suit)
         self.assertTrue(play_response.success)
 
     def test_play_after_ace_suit_override(self):
@@ -1008,3 +1289,24 @@ class TestGame(TestCase):
         self.assertEquals(1, player_two.played)
         self.assertEquals(1, player.won)
         self.assertEquals(0, player_two.won)
+
+    def test_legal_moves(self):
+        player = models.Player("bob")
+        player_two = models.Player("john")
+
+        players = [player, player_two,]
+
+        deck = models.Deck(None)
+        deck.add_card(models.Card(models.Suit.hearts, models.Rank.seven))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.five))
+        deck.add_card(models.Card(models.Suit.diamonds, models.Rank.six))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.three))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.king))
+
+        game = engine.Game(players, 2, deck)
+
+        moves = game.legal_moves("bob")
+
+        self.assertEquals(1, len(moves))
+        self.assertEquals(engine.MoveType.pick, moves[0].move_type)
+        self.assertEquals([], game.legal_moves("john"))
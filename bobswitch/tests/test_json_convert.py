@@ -87,3 +87,155 @@ class TestConvert(TestCase):
         self.assertEquals(1, player_two["won"])
 
         self.assertEquals("wait", state_converted["state"])
+
+
+class TestCompact(TestCase):
+
+    def test_compact_hand(self):
+        hand = models.Hand()
+        hand.add_card(models.Card(models.Suit.hearts, models.Rank.ace))
+        hand.add_card(models.Card(models.Suit.spades, models.Rank.king))
+
+        self.assertEquals([0, 51], json_convert.compact_hand(hand))
+
+    def test_compact_state_start(self):
+        card = models.Card(models.Suit.hearts, models.Rank.ace)
+        top = models.Card(models.Suit.spades, models.Rank.ace)
+
+        hand = models.Hand()
+        hand.add_card(card)
+
+        bob_hand = engine.PlayerHand("bob")
+        bob_hand.hand.add_card(card)
+
+        bob = models.Player("bob")
+        bob.played = 3
+        bob.won = 2
+
+        state = json_convert.compact_state_start(engine.GameState.WAIT, 
+                [bob], {"bob": bob_hand}, 1, top, hand)
+
+        self.assertEquals([[["bob", 1, 3, 2]], 1, 39, 2, [0]], state)
+
+    def test_compact_play_response(self):
+        play_response = engine.invalid_play_response("Not a valid move")
+
+        self.assertEquals([False, "Not a valid move"], 
+                json_convert.compact_play_response(play_response))
+
+
+class TestStateDelta(TestCase):
+
+    def create_views(self):
+        game = engine.Game([models.Player("bob"), models.Player("scott")], 
+                7, engine.create_deck(5))
+        old_view = json_convert.StateView(game, 3, (1 << 0) | (1 << 5), 
+                (2, 4), 10, engine.GameState.NORMAL, 1, 
+                engine.GameDirection.clockwise)
+        new_view = json_convert.StateView(game, 4, (1 << 0) | (1 << 51), 
+                (2, 5), 10, engine.GameState.PICK, 2, 
+                engine.GameDirection.clockwise)
+
+        return old_view, new_view
+
+    def test_delta(self):
+        old_view, new_view = self.create_views()
+
+        delta = json_convert.convert_state_delta(old_view, new_view)
+
+        self.assertEquals({
+            "seq": 4,
+            "base": 3,
+            "added": [{"suit": 3, "rank": 13}],
+            "removed": [{"suit": 0, "rank": 6}],
+            "counts": [[1, 5]],
+            "state": "pick",
+            "starting_player": 2
+        }, delta)
+
+    def test_delta_compact(self):
+        old_view, new_view = self.create_views()
+
+        delta = json_convert.convert_state_delta(old_view, new_view, True)
+
+        self.assertEquals([4, 3, [51], [5], [[1, 5]], None, 1, 2, None], delta)
+
+    def test_delta_top_card_and_direction(self):
+        old_view, new_view = self.create_views()
+        new_view.top_card = 11
+        new_view.direction = engine.GameDirection.anticlockwise
+
+        delta = json_convert.convert_state_delta(old_view, new_view)
+
+        self.assertEquals({"suit": 0, "rank": 12}, delta["top_card"])
+        self.assertEquals("anticlockwise", delta["direction"])
+
+
+class TestStateSnapshot(TestCase):
+
+    def create_game(self):
+        players = [models.Player("bob"), models.Player("scott")]
+        deck = engine.create_deck(5)
+        deck.shuffle()
+
+        return engine.Game(players, 7, deck)
+
+    def test_watch_state(self):
+        game = self.create_game()
+        snapshot = json_convert.StateSnapshot(game)
+
+        state = snapshot.watch_state()
+
+        self.assertEquals(json_convert.convert_state_watch(game.state, 
+            game.players, game.player_hands, game.current_player,
+            game.played_cards.top_card, game.direction), state)
+
+    def test_watch_state_cached(self):
+        game = self.create_game()
+        snapshot = json_convert.StateSnapshot(game)
+
+        self.assertTrue(snapshot.watch_state() is snapshot.watch_state())
+
+    def test_watch_state_rebuilt_on_change(self):
+        game = self.create_game()
+        snapshot = json_convert.StateSnapshot(game)
+
+        state = snapshot.watch_state()
+        game.version = game.version + 1
+
+        self.assertFalse(state is snapshot.watch_state())
+
+    def test_player_state(self):
+        game = self.create_game()
+        snapshot = json_convert.StateSnapshot(game)
+
+        state = snapshot.player_state("bob")
+
+        self.assertEquals(json_convert.convert_state_start(game.state, 
+            game.players, game.player_hands, game.current_player,
+            game.played_cards.top_card, game.player_hand("bob"), 
+            game.direction), state)
+        self.assertFalse("hand" in snapshot.watch_state())
+
+    def test_compact_player_state(self):
+        game = self.create_game()
+        snapshot = json_convert.StateSnapshot(game)
+
+        state = snapshot.player_state("bob", True)
+
+        self.assertEquals(json_convert.compact_state_start(game.state, 
+            game.players, game.player_hands, game.current_player,
+            game.played_cards.top_card, game.player_hand("bob"), 
+            game.direction), state)
+        self.assertEquals(5, len(snapshot.watch_state(True)))
+
+    def test_player_view(self):
+        game = self.create_game()
+        snapshot = json_convert.StateSnapshot(game)
+
+        view = snapshot.player_view("bob")
+
+        self.assertEquals(game.player_hand("bob").mask, view.hand_mask)
+        self.assertEquals((7, 7), view.counts)
+        self.assertEquals(game.played_cards.top_card.index, view.top_card)
+        self.assertEquals(game.version, view.version)
@@ -1,3 +1,4 @@
+import pickle
 import random
 
 from unittest2 import TestCase, main, skip
@@ -57,6 +58,85 @@ class TestCard(TestCase):
 
         self.assertNotEquals(card, card2)
 
+    def test_index(self):
+        card = models.Card(models.Suit.hearts, models.Rank.ace) 
+        card2 = models.Card(models.Suit.spades, models.Rank.king) 
+
+        self.assertEquals(0, card.index)
+        self.assertEquals(51, card2.index)
+
+    def test_index_ids(self):
+        card = models.Card(models.Suit.diamonds, models.Rank.four) 
+
+        self.assertEquals(2, card.suit_id)
+        self.assertEquals(4, card.rank_id)
+
+    def test_from_index(self):
+        for suit in models.Suit:
+            for rank in models.Rank:
+                card = models.Card(suit, rank)
+                card2 = models.Card.from_index(card.index)
+
+                self.assertEquals(card, card2)
+                self.assertEquals(suit, card2.suit)
+                self.assertEquals(rank, card2.rank)
+
+    def test_indexes_unique(self):
+        indexes = set(models.Card(suit, rank).index 
+                for suit in models.Suit for rank in models.Rank)
+
+        self.assertEquals(set(range(models.NUMBER_OF_CARDS)), indexes)
+
+    def test_ne(self):
+        card = models.Card(models.Suit.hearts, models.Rank.ace) 
+
+        self.assertFalse(card != models.Card(models.Suit.hearts, models.Rank.ace))
+        self.assertTrue(card != models.Card(models.Suit.clubs, models.Rank.ace))
+        self.assertTrue(card != None)
+
+    def test_hashable(self):
+        cards = set(models.Card(suit, rank) 
+                for suit in models.Suit for rank in models.Rank)
+        cards.add(models.Card(models.Suit.hearts, models.Rank.ace))
+
+        self.assertEquals(models.NUMBER_OF_CARDS, len(cards))
+        self.assertTrue(models.Card(models.Suit.clubs, models.Rank.two) in cards)
+
+    def test_interned(self):
+        card = models.Card(models.Suit.clubs, models.Rank.five)
+
+        self.assertTrue(card is models.Card(models.Suit.clubs, models.Rank.five))
+        self.assertTrue(card is models.Card.from_index(card.index))
+        self.assertTrue(card is models.get_card(1, 5))
+
+    def test_immutable(self):
+        card = models.Card(models.Suit.clubs, models.Rank.five)
+
+        def set_suit():
+            card.suit = models.Suit.hearts
+        def set_index():
+            card.index = 0
+
+        self.assertRaises(AttributeError, set_suit)
+        self.assertRaises(AttributeError, set_index)
+        self.assertEquals(models.Suit.clubs, card.suit)
+
+    def test_pickle_interned(self):
+        card = models.Card(models.Suit.clubs, models.Rank.five)
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertTrue(card is pickle.loads(pickle.dumps(card, protocol)))
+
+
+class TestMaskIndexes(TestCase):
+
+    def test_mask_indexes(self):
+        self.assertEquals([0, 5, 51], 
+                models.mask_indexes((1 << 0) | (1 << 5) | (1 << 51)))
+
+    def test_mask_indexes_empty(self):
+        self.assertEquals([], models.mask_indexes(0))
+
 
 class TestCardGroup(TestCase):
 
@@ -130,9 +210,146 @@ class TestHand(TestCase):
         self.assertFalse(result)
         self.assertEquals(1, len(hand.cards))
 
+    def test_add_cards_contains(self):
+        hand = models.Hand()
+        hand.add_cards([models.Card(models.Suit.hearts, models.Rank.ace),
+                 models.Card(models.Suit.spades, models.Rank.king)])
+
+        self.assertTrue(hand.contains_card(
+            models.Card(models.Suit.spades, models.Rank.king)))
+        self.assertFalse(hand.contains_card(
+            models.Card(models.Suit.spades, models.Rank.queen)))
+
+    def test_remove_card_clears_mask(self):
+        hand = models.Hand()
+        hand.add_card(models.Card(models.Suit.hearts, models.Rank.ace))
+
+        card = models.Card(models.Suit.hearts, models.Rank.ace)
+        hand.remove_card(card)
+
+        self.assertEquals(0, hand.mask)
+        self.assertFalse(hand.contains_card(card))
+
+    def test_remove_card_twice(self):
+        hand = models.Hand()
+        card = models.Card(models.Suit.hearts, models.Rank.ace)
+        hand.add_card(card)
+
+        self.assertTrue(hand.remove_card(card))
+        self.assertFalse(hand.remove_card(card))
+        self.assertEquals(0, hand.mask)
+
+    def test_add_cards_generator(self):
+        hand = models.Hand()
+        hand.add_cards(card for card in models.CARDS[:3])
+
+        self.assertEquals(list(models.CARDS[:3]), hand.cards)
+        self.assertEquals(7, hand.mask)
+        self.assertTrue(hand.contains_card(models.CARDS[2]))
+
+    def test_has_suit(self):
+        hand = models.Hand()
+        hand.add_card(models.Card(models.Suit.diamonds, models.Rank.six))
+
+        self.assertTrue(hand.has_suit(int(models.Suit.diamonds)))
+        self.assertFalse(hand.has_suit(int(models.Suit.clubs)))
+
+    def test_has_rank(self):
+        hand = models.Hand()
+        hand.add_card(models.Card(models.Suit.diamonds, models.Rank.eight))
+
+        self.assertTrue(hand.has_rank(int(models.Rank.eight)))
+        self.assertFalse(hand.has_rank(int(models.Rank.two)))
+
+
+class TestIndexedCardGroup(TestCase):
+
+    def test_not_indexed(self):
+        group = models.CardGroup()
+        card = models.Card(models.Suit.hearts, models.Rank.ace)
+        group.add_card(card)
+
+        self.assertEquals(None, group.counts)
+        self.assertTrue(group.contains_card(card))
+        self.assertTrue(group.remove_card(card))
+        self.assertFalse(group.contains_card(card))
+
+    def test_indexed(self):
+        group = models.CardGroup(indexed=True)
+        card = models.Card(models.Suit.hearts, models.Rank.ace)
+        card2 = models.Card(models.Suit.clubs, models.Rank.two)
+        group.add_cards([card, card2, card])
+
+        self.assertEquals(2, group.counts[card])
+        self.assertTrue(group.remove_card(card))
+        self.assertTrue(group.contains_card(card))
+        self.assertTrue(group.remove_card(card))
+        self.assertFalse(group.contains_card(card))
+        self.assertFalse(group.remove_card(card))
+        self.assertEquals([card2], group.cards)
+        self.assertEquals({card2: 1}, dict(group.counts))
+
+    def test_indexed_deck(self):
+        deck = models.Deck(None, indexed=True)
+        deck.add_cards(models.CARDS[:5])
+
+        dealt = deck.deal_card()
+        dealt_cards = deck.deal_cards(2)
+
+        self.assertFalse(deck.contains_card(dealt))
+        self.assertFalse(any(deck.contains_card(c) for c in dealt_cards))
+        self.assertTrue(all(deck.contains_card(c) for c in deck.cards))
+        self.assertEquals(2, sum(deck.counts.values()))
+
+    def test_indexed_played_cards(self):
+        played_cards = models.PlayedCards(indexed=True)
+        for card in models.CARDS[:3]:
+            played_cards.add_card(card)
+
+        self.assertTrue(played_cards.contains_card(models.CARDS[0]))
+
+        played_cards.return_played_cards()
+
+        self.assertFalse(played_cards.contains_card(models.CARDS[0]))
+
+    def test_hand_keeps_order(self):
+        hand = models.Hand()
+        cards = [models.Card.from_index(index) for index in (40, 3, 17, 9)]
+        hand.add_cards(cards)
+
+        hand.remove_card(cards[2])
+
+        self.assertEquals([cards[0], cards[1], cards[3]], hand.cards)
+        self.assertEquals(None, hand.counts)
+        self.assertFalse(hand.contains_card(cards[2]))
+
 
 class TestPlayedCards(TestCase):
 
+    def test_suit_override_leaves_card(self):
+        played_cards = models.PlayedCards()
+        card = models.Card(models.Suit.hearts, models.Rank.ace) 
+
+        played_cards.add_card(card, models.Suit.spades)
+
+        self.assertEquals(models.Suit.hearts, card.suit)
+        self.assertTrue(card is played_cards.top_card)
+        self.assertEquals(models.Suit.spades, played_cards.declared_suit)
+        self.assertEquals(models.Card(models.Suit.spades, models.Rank.ace), 
+                played_cards.active_card())
+
+    def test_declared_suit_cleared(self):
+        played_cards = models.PlayedCards()
+        card = models.Card(models.Suit.hearts, models.Rank.ace) 
+        card2 = models.Card(models.Suit.spades, models.Rank.two) 
+
+        played_cards.add_card(card, models.Suit.spades)
+        played_cards.add_card(card2)
+
+        self.assertEquals(None, played_cards.declared_suit)
+        self.assertTrue(card2 is played_cards.active_card())
+        self.assertTrue(card is played_cards.cards[-1])
+
     def test_init(self):
         played_cards = models.PlayedCards()
         self.assertEquals(0, len(played_cards.cards))
@@ -197,6 +414,43 @@ class TestDeck(TestCase):
 
         self.assertEquals(models.Card(models.Suit.diamonds, models.Rank.ace), card)
 
+    def test_deal_cards(self):
+        deck = models.Deck(None)
+        deck.add_card(models.Card(models.Suit.hearts, models.Rank.ace))
+        deck.add_card(models.Card(models.Suit.clubs, models.Rank.ace))
+        deck.add_card(models.Card(models.Suit.diamonds, models.Rank.ace))
+
+        cards = deck.deal_cards(2)
+
+        self.assertEquals([models.Card(models.Suit.diamonds, models.Rank.ace),
+            models.Card(models.Suit.clubs, models.Rank.ace)], cards)
+        self.assertEquals(1, deck.number_of_cards())
+
+    def test_deal_cards_none(self):
+        deck = models.Deck(None)
+        deck.add_card(models.Card(models.Suit.hearts, models.Rank.ace))
+
+        self.assertEquals([], deck.deal_cards(0))
+        self.assertEquals(1, deck.number_of_cards())
+
+    def test_deal_cards_too_many(self):
+        deck = models.Deck(None)
+        deck.add_card(models.Card(models.Suit.hearts, models.Rank.ace))
+
+        self.failUnlessRaises(IndexError, deck.deal_cards, 2)
+        self.assertEquals(1, deck.number_of_cards())
+
+    def test_shuffle_single_pass(self):
+        deck = models.Deck(random.Random(64))
+        cards = [models.Card(suit, models.Rank.ace) for suit in models.Suit]
+        deck.add_cards(cards)
+
+        deck.shuffle(passes=1)
+
+        expected = list(cards)
+        random.Random(64).shuffle(expected)
+        self.assertEquals(expected, deck.cards)
+
     def test_shuffle(self):
         rand = random.Random(64)
         deck = models.Deck(rand)
@@ -251,3 +505,18 @@ class TestDeck(TestCase):
         self.assertEquals(models.Card(Suit.clubs, Rank.ace), deck.deal_card())
         self.assertEquals(models.Card(Suit.hearts, Rank.two), deck.deal_card())
         self.assertEquals(models.Card(Suit.hearts, Rank.ace), deck.deal_card())
+
+    def test_shuffle_with_random(self):
+        deck = models.Deck(None)
+        deck2 = models.Deck(random.Random(64))
+        
+        for d in (deck, deck2):
+            d.add_card(models.Card(models.Suit.hearts, models.Rank.ace))
+            d.add_card(models.Card(models.Suit.clubs, models.Rank.ace))
+            d.add_card(models.Card(models.Suit.diamonds, models.Rank.ace))
+            d.add_card(models.Card(models.Suit.hearts, models.Rank.two))
+
+        deck.shuffle(random.Random(64))
+        deck2.shuffle()
+
+        self.assertEquals(deck2.cards, deck.cards)
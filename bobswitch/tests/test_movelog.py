@@ -0,0 +1,166 @@
+import json
+import random
+from StringIO import StringIO
+
+from unittest2 import TestCase, main, skip
+
+from bobswitch import engine
+from bobswitch import models
+from bobswitch import movelog
+from bobswitch import snapshot
+from bobswitch import simulator
+
+def create_logged_game(log, game_id, seed, player_names):
+    deck = engine.create_deck(seed)
+    deck.shuffle()
+    players = [models.Player(name) for name in player_names]
+    game = engine.Game(players, 7, deck)
+    log.start_game(game_id, game, 7)
+
+    return game
+
+def play_moves(game, count, rand):
+    for _ in xrange(count):
+        if game.state is engine.GameState.FINISHED:
+            break
+        player = game.players[game.current_player - 1]
+        move = simulator.random_policy(game, player.name,
+                game.legal_moves(player.name), rand)
+        if move.card is not None:
+            move = engine.GameMove(move.move_type,
+                    models.Card.from_index(move.card.index), move.suit)
+        game.play(player.name, move)
+
+def indexes(cards):
+    return [card.index for card in cards]
+
+class TestMoveEncoding(TestCase):
+
+    def test_round_trip(self):
+        move = engine.GameMove(engine.MoveType.play,
+                models.Card(models.Suit.spades, models.Rank.ace),
+                models.Suit.hearts)
+
+        decoded = movelog.decode_move(movelog.encode_move(move))
+
+        self.assertEquals(engine.MoveType.play, decoded.move_type)
+        self.assertEquals(move.card, decoded.card)
+        self.assertEquals(models.Suit.hearts, decoded.suit)
+
+    def test_pick(self):
+        move = engine.GameMove(engine.MoveType.pick)
+
+        self.assertEquals([0, None, None], movelog.encode_move(move))
+
+
+class TestMoveLog(TestCase):
+
+    def setUp(self):
+        self.log_file = StringIO()
+        self.log = movelog.MoveLog(self.log_file)
+
+    def lines(self):
+        return StringIO(self.log_file.getvalue())
+
+    def test_records(self):
+        game = create_logged_game(self.log, "room:1", 1, ["bob", "scott"])
+        player = game.players[game.current_player - 1]
+        game.play(player.name, game.legal_moves(player.name)[0])
+        game.play(player.name, engine.GameMove(engine.MoveType.pick))
+
+        records = list(movelog.read_log(self.lines()))
+
+        self.assertEquals(2, len(records))
+        self.assertEquals("game", records[0]["type"])
+        self.assertEquals(1, records[0]["seed"])
+        self.assertEquals(["bob", "scott"], records[0]["players"])
+        self.assertEquals("move", records[1]["type"])
+        self.assertEquals(1, records[1]["version"])
+        self.assertEquals(player.name, records[1]["player"])
+
+    def test_partial_line_skipped(self):
+        create_logged_game(self.log, "room:1", 1, ["bob", "scott"])
+        self.log_file.write('{"type": "mo')
+
+        self.assertEquals(1, len(list(movelog.read_log(self.lines()))))
+
+    def test_replay_reconstructs_games(self):
+        rand = random.Random(3)
+        games = [create_logged_game(self.log, "room:%d" % i, i, 
+            ["bob", "scott", "sam"]) for i in range(3)]
+        for _ in range(20):
+            for game in games:
+                play_moves(game, 5, rand)
+
+        for i, game in enumerate(games):
+            replayed = movelog.replay_game(movelog.read_log(self.lines()),
+                    "room:%d" % i)
+
+            self.assertEquals(game.version, replayed.version)
+            self.assertEquals(game.state, replayed.state)
+            self.assertEquals(game.current_player, replayed.current_player)
+            self.assertEquals(indexes(game.deck.cards),
+                    indexes(replayed.deck.cards))
+            for player in game.players:
+                self.assertEquals(game.player_hand(player.name).mask,
+                        replayed.player_hand(player.name).mask)
+
+    def test_replay_restored_games(self):
+        rand = random.Random(7)
+        for seed in range(20):
+            game_id = "room:%d" % (seed,)
+            game = create_logged_game(self.log, game_id, seed, 
+                    ["bob", "scott", "sam"])
+            play_moves(game, 10, rand)
+            stored = snapshot.dump_game(game)
+            #moves the store never saw before the restart
+            play_moves(game, 3, rand)
+
+            restored = snapshot.load_game(stored)
+            self.log.restore_game(game_id, restored)
+            play_moves(restored, 200, rand)
+
+            replayed = movelog.replay_game(movelog.read_log(self.lines()),
+                    game_id)
+
+            self.assertEquals(restored.version, replayed.version)
+            self.assertEquals(restored.state, replayed.state)
+            self.assertEquals(restored.reshuffles, replayed.reshuffles)
+            self.assertEquals(indexes(restored.deck.cards),
+                    indexes(replayed.deck.cards))
+            for player in restored.players:
+                self.assertEquals(restored.player_hand(player.name).mask,
+                        replayed.player_hand(player.name).mask)
+
+    def test_replay_game_version(self):
+        game = create_logged_game(self.log, "room:1", 1, ["bob", "scott"])
+        play_moves(game, 3, random.Random(1))
+        hand = game.player_hand("bob").mask
+        play_moves(game, 3, random.Random(1))
+
+        replayed = movelog.replay_game(movelog.read_log(self.lines()),
+                "room:1", 3)
+
+        self.assertEquals(3, replayed.version)
+        self.assertEquals(hand, replayed.player_hand("bob").mask)
+
+    def test_replay_drops_finished_games(self):
+        game = create_logged_game(self.log, "room:1", 1, ["bob", "scott"])
+        play_moves(game, 5000, random.Random(1))
+        self.assertEquals(engine.GameState.FINISHED, game.state)
+        self.log_file.write(json.dumps({"type": "move", "game": "room:1",
+            "version": 1, "player": "bob", "move": [0, None, None]}) + "\n")
+
+        replayer = movelog.replay(movelog.read_log(self.lines()))
+
+        self.assertRaises(ValueError, list, replayer)
+
+    def test_replay_refused_move(self):
+        game = create_logged_game(self.log, "room:1", 1, ["bob", "scott"])
+        waiting = game.players[game.current_player % 2]
+        self.log.write({"type": "move", "game": "room:1", "version": 1,
+            "player": waiting.name, "move": [0, None, None]})
+
+        replayer = movelog.replay(movelog.read_log(self.lines()))
+
+        self.assertRaises(ValueError, list, replayer)
@@ -0,0 +1,131 @@
+import json
+
+from unittest2 import TestCase, main, skip
+import tornado.web
+import sockjs.tornado
+from tornado.ioloop import IOLoop
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.websocket import websocket_connect
+
+from bobswitch import sharding
+
+class TestShardForRoom(TestCase):
+
+    def test_stable(self):
+        self.assertEquals(sharding.shard_for_room("room", 4),
+                sharding.shard_for_room("room", 4))
+
+    def test_unicode_matches_bytes(self):
+        self.assertEquals(sharding.shard_for_room("room", 4),
+                sharding.shard_for_room(u"room", 4))
+
+    def test_in_range(self):
+        shards = set(sharding.shard_for_room("room%d" % i, 3) 
+                for i in range(100))
+
+        self.assertEquals(set([0, 1, 2]), shards)
+
+    def test_single_shard(self):
+        self.assertEquals(0, sharding.shard_for_room("room", 1))
+
+
+class TestShard(TestCase):
+
+    def test_owns_one_worker_per_room(self):
+        shards = [sharding.Shard(i, 3, 4500) for i in range(3)]
+
+        for i in range(50):
+            owners = [shard for shard in shards if shard.owns("room%d" % i)]
+            self.assertEquals(1, len(owners))
+
+    def test_describe(self):
+        shard = sharding.Shard(0, 3, 4500)
+        index = sharding.shard_for_room("room", 3)
+
+        self.assertEquals({"room": "room", "shard": index, "port": 4500 + index},
+                shard.describe("room"))
+
+
+class EchoConnection(sockjs.tornado.SockJSConnection):
+    """Worker that answers every message with its index and the message"""
+
+    index = None
+
+    def on_message(self, message):
+        self.send(json.dumps([self.index, json.loads(message)]))
+
+
+class TestShardProxyConnection(TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop()
+        self.addCleanup(self.io_loop.close, True)
+
+        self.workers = []
+        ports = []
+        for index in range(2):
+            worker = type("Worker%d" % index, (EchoConnection,), 
+                    {"index": index})
+            router = sockjs.tornado.SockJSRouter(worker, "/bobswitch", 
+                    io_loop=self.io_loop)
+            sock, port = bind_unused_port()
+            ports.append(port)
+            self.listen(tornado.web.Application(router.urls), sock)
+
+        #the free ports found needn't follow each other
+        shard = sharding.Shard(None, 2, ports[0])
+        shard.worker_port = ports.__getitem__
+        proxy = type("Proxy", (sharding.ShardProxyConnection,), 
+                {"shard": shard, "io_loop": self.io_loop})
+        router = sockjs.tornado.SockJSRouter(proxy, "/bobswitch", 
+                io_loop=self.io_loop)
+        sock, self.front_port = bind_unused_port()
+        self.listen(tornado.web.Application(router.urls), sock)
+
+    def listen(self, application, sock):
+        server = HTTPServer(application, io_loop=self.io_loop)
+        server.add_sockets([sock])
+        self.addCleanup(server.stop)
+
+    def connect(self):
+        return self.io_loop.run_sync(lambda: websocket_connect(
+            "ws://127.0.0.1:%d/bobswitch/websocket" % (self.front_port,),
+            self.io_loop))
+
+    def send(self, client, name, room=None):
+        client.write_message(json.dumps({"name": name, "room": room}))
+        return json.loads(self.io_loop.run_sync(client.read_message, 
+            timeout=5))
+
+    def room_on(self, index):
+        return next(name for name in ("room%d" % i for i in range(100))
+                if sharding.shard_for_room(name, 2) == index)
+
+    def test_routes_by_listing(self):
+        client = self.connect()
+
+        self.assertEquals(0, self.send(client, "connection:protocol")[0])
+
+        index, message = self.send(client, "account:listing", 
+                self.room_on(1))
+        #the new worker is sent the setup events before the listing
+        self.assertEquals([1, {"name": "connection:protocol", "room": None}],
+                [index, message])
+        index, message = json.loads(
+                self.io_loop.run_sync(client.read_message, timeout=5))
+        self.assertEquals([1, "account:listing"], [index, message["name"]])
+
+        self.assertEquals(1, self.send(client, "chat:message", "other")[0])
+
+        self.send(client, "account:listing", self.room_on(0))
+        index, message = json.loads(
+                self.io_loop.run_sync(client.read_message, timeout=5))
+        self.assertEquals([0, "account:listing"], [index, message["name"]])
+
+    def test_listing_without_room(self):
+        client = self.connect()
+
+        index, message = self.send(client, "account:listing")
+
+        self.assertEquals([0, "account:listing"], [index, message["name"]])
@@ -0,0 +1,66 @@
+from unittest2 import TestCase, main, skip
+
+from bobswitch import engine
+from bobswitch import models
+from bobswitch import simulator
+
+
+class TestPolicies(TestCase):
+
+    def test_best_suit(self):
+        hand = models.Hand()
+        hand.add_card(models.Card(models.Suit.clubs, models.Rank.seven))
+        hand.add_card(models.Card(models.Suit.spades, models.Rank.four))
+        hand.add_card(models.Card(models.Suit.spades, models.Rank.six))
+
+        self.assertEquals(models.Suit.spades, simulator.best_suit(hand))
+
+    def test_first_policy(self):
+        moves = [engine.GameMove(engine.MoveType.pick)]
+
+        move = simulator.first_policy(None, "bob", moves, None)
+
+        self.assertEquals(engine.MoveType.pick, move.move_type)
+
+
+class TestSimulateGame(TestCase):
+
+    def test_game_finishes(self):
+        result = simulator.simulate_game(1, ["random", "first"])
+
+        self.assertTrue(result.winner in (0, 1))
+        self.assertTrue(result.moves > 0)
+
+    def test_same_seed_same_game(self):
+        result = simulator.simulate_game(42, ["random", "random", "first"])
+        result2 = simulator.simulate_game(42, ["random", "random", "first"])
+
+        self.assertEquals(result.winner, result2.winner)
+        self.assertEquals(result.moves, result2.moves)
+        self.assertEquals(result.reshuffles, result2.reshuffles)
+
+    def test_max_moves_stalls(self):
+        result = simulator.simulate_game(1, ["random", "first"], max_moves=1)
+
+        self.assertEquals(None, result.winner)
+        self.assertEquals(1, result.moves)
+
+
+class TestRunSimulations(TestCase):
+
+    def test_single_process(self):
+        report = simulator.run_simulations(25, ["random", "first"],
+                processes=1, chunk_size=10)
+
+        self.assertEquals(25, report.games)
+        self.assertEquals(25, sum(report.wins) + report.stalled)
+        self.assertTrue(report.min_moves <= report.average_moves()
+                <= report.max_moves)
+
+    def test_pool_matches_single_process(self):
+        report = simulator.run_simulations(20, ["random", "first"],
+                processes=1, chunk_size=5)
+        report2 = simulator.run_simulations(20, ["random", "first"],
+                processes=2, chunk_size=5)
+
+        self.assertEquals(report.as_dict(), report2.as_dict())
@@ -0,0 +1,154 @@
+import pickle
+
+from unittest2 import TestCase, main, skip
+
+from bobswitch import engine
+from bobswitch import models
+from bobswitch import snapshot
+
+def create_test_game(player_names, seed=1234):
+    deck = engine.create_deck(seed)
+    deck.shuffle()
+    players = [models.Player(name) for name in player_names]
+
+    return engine.Game(players, 7, deck)
+
+def play_moves(game, count):
+    for _ in xrange(count):
+        if game.state is engine.GameState.FINISHED:
+            break
+        player = game.players[game.current_player - 1]
+        move = game.legal_moves(player.name)[0]
+        if move.card is not None:
+            move = engine.GameMove(move.move_type, 
+                    models.Card.from_index(move.card.index), models.Suit.clubs)
+        game.play(player.name, move)
+
+def indexes(cards):
+    return [card.index for card in cards]
+
+class TestSnapshot(TestCase):
+
+    def assertGamesEqual(self, game, restored):
+        self.assertEquals(game.state, restored.state)
+        self.assertEquals(game.direction, restored.direction)
+        self.assertEquals(game.current_player, restored.current_player)
+        self.assertEquals(game.accumulated_count, restored.accumulated_count)
+        self.assertEquals(game.first_play, restored.first_play)
+        self.assertEquals(game.version, restored.version)
+        self.assertEquals(game.reshuffles, restored.reshuffles)
+        self.assertEquals(game.seed, restored.seed)
+        self.assertEquals(indexes(game.deck.cards), 
+                indexes(restored.deck.cards))
+        self.assertEquals(indexes(game.played_cards.cards), 
+                indexes(restored.played_cards.cards))
+        self.assertEquals(game.played_cards.top_card.index, 
+                restored.played_cards.top_card.index)
+        self.assertEquals([p.name for p in game.players], 
+                [p.name for p in restored.players])
+        for player in game.players:
+            hand = game.player_hand(player.name)
+            restored_hand = restored.player_hand(player.name)
+            self.assertEquals(indexes(hand.cards), indexes(restored_hand.cards))
+            self.assertEquals(hand.mask, restored_hand.mask)
+
+    def test_round_trip_new_game(self):
+        game = create_test_game(["bob", "scott", "sam"])
+
+        restored = snapshot.load_game(snapshot.dump_game(game))
+
+        self.assertGamesEqual(game, restored)
+
+    def test_round_trip_played_game(self):
+        game = create_test_game(["bob", "scott"])
+        game.players[0].won = 3
+        play_moves(game, 30)
+
+        restored = snapshot.load_game(snapshot.dump_game(game))
+
+        self.assertGamesEqual(game, restored)
+        self.assertEquals(3, restored.players[0].won)
+
+    def test_largest_seed(self):
+        game = create_test_game(["bob", "scott"], 2 ** 32 - 1)
+
+        self.assertEquals(2 ** 32 - 1, 
+                snapshot.load_game(snapshot.dump_game(game)).seed)
+
+    def test_unicode_names(self):
+        game = create_test_game([u"b\xf6b", "scott"])
+
+        restored = snapshot.load_game(snapshot.dump_game(game))
+
+        self.assertEquals(u"b\xf6b", restored.players[0].name)
+
+    def test_shares_players(self):
+        game = create_test_game(["bob", "scott"])
+        bob = models.Player("bob")
+
+        restored = snapshot.load_game(snapshot.dump_game(game), {"bob": bob})
+
+        self.assertTrue(restored.players[0] is bob)
+
+    def test_random_state(self):
+        game = create_test_game(["bob", "scott"])
+
+        restored = snapshot.load_game(snapshot.dump_game(game, True))
+
+        self.assertEquals(game.deck.random.random(), 
+                restored.deck.random.random())
+
+    def test_restored_game_plays_on(self):
+        game = create_test_game(["bob", "scott"])
+        play_moves(game, 5)
+        data = snapshot.dump_game(game, True)
+
+        restored = snapshot.load_game(data)
+        play_moves(restored, 200)
+
+        self.assertTrue(restored.version > game.version)
+
+    def test_smaller_than_pickle(self):
+        game = create_test_game(["bob", "scott", "sam", "tom"])
+
+        self.assertTrue(len(snapshot.dump_game(game)) * 10 < 
+                len(pickle.dumps(game, pickle.HIGHEST_PROTOCOL)))
+
+    def test_bad_magic(self):
+        self.assertRaises(ValueError, snapshot.load_game, "XXX\x01")
+
+    def test_bad_version(self):
+        data = snapshot.dump_game(create_test_game(["bob", "scott"]))
+
+        self.assertRaises(ValueError, snapshot.load_game, 
+                data[:3] + "\x63" + data[4:])
+
+    def test_bad_card(self):
+        data = snapshot.dump_game(create_test_game(["bob", "scott"]))
+        #the top card byte comes before the declared suit at the end
+        self.assertRaises(ValueError, snapshot.load_game, 
+                data[:-2] + "\x34" + data[-1:])
+
+    def test_truncated(self):
+        data = snapshot.dump_game(create_test_game(["bob", "scott"]))
+
+        self.assertRaises(ValueError, snapshot.load_game, data[:-5])
+
+    def test_declared_suit(self):
+        game = create_test_game(["bob", "scott"])
+        game.played_cards.add_card(
+                models.Card(models.Suit.hearts, models.Rank.ace), 
+                models.Suit.spades)
+
+        restored = snapshot.load_game(snapshot.dump_game(game, True))
+
+        self.assertEquals(models.Suit.hearts, 
+                restored.played_cards.top_card.suit)
+        self.assertEquals(models.Suit.spades, 
+                restored.played_cards.declared_suit)
+
+    def test_rejects_version_1(self):
+        data = snapshot.dump_game(create_test_game(["bob", "scott"]))
+
+        self.assertRaises(ValueError, snapshot.load_game, 
+                data[:3] + "\x01" + data[4:-1])
@@ -1,8 +1,15 @@
 import json
 
+from mock import MagicMock
 from unittest2 import TestCase, main, skip
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.concurrent import Future
 
-from bobswitch.sockjs_ext import event, EventMagicMeta, EventSocketConnection
+from bobswitch import config
+from bobswitch.sockjs_ext import event, EventMagicMeta, EventSocketConnection, \
+        compile_schema, MessageError, Optional, SerialExecutor
+from bobswitch.codec import Codec
 
 class TestMeta(TestCase):
 
@@ -143,5 +150,472 @@ class TestMeta(TestCase):
 
         self.assertEquals('{"message": "hello", "type": "event", "name": "bob"}', called["message"])
 
+    def test_send_event_uses_codec(self):
+        called = {"message": None,} 
+
+        class TestMessage(EventSocketConnection):
+            codec = Codec("test", lambda data: data["name"], json.loads)
+
+            def send(self, message):
+                called["message"] = message
+                
+        test_message = TestMessage(None)
+
+        test_message.send_event("bob", "hello")
+
+        self.assertEquals("bob", called["message"])
+
+    def test_on_message_uses_codec(self):
+        called = {"message": None,} 
+
+        class TestMessage(EventSocketConnection):
+            codec = Codec("test", json.dumps, 
+                    lambda data: {"name": "test1", "message": data})
+
+            @event
+            def test1(self, room, message):
+                called["message"] = message
+
+        test_message = TestMessage(None)
+
+        test_message.on_message("raw")
+
+        self.assertEquals("raw", called["message"])
+
+    def test_select_protocol(self):
+        called = {"message": None,} 
+
+        class TestMessage(EventSocketConnection):
+            def send(self, message):
+                called["message"] = message
+
+        test_message = TestMessage(None)
+
+        test_message.on_message('{"name":"connection:protocol", "message":"compact"}')
+
+        self.assertTrue(test_message.is_compact())
+        self.assertEquals('["connection:protocol", "compact"]', called["message"])
+
+    def test_select_invalid_protocol(self):
+        class TestMessage(EventSocketConnection):
+            def send(self, message):
+                pass
+
+        test_message = TestMessage(None)
+
+        test_message.select_protocol(None, "xml")
+
+        self.assertEquals("json", test_message.protocol)
+
+    def test_broadcast_event_per_protocol(self):
+        sent = []
+
+        class TestMessage(EventSocketConnection):
+            def broadcast(self, clients, message):
+                sent.append((clients, message))
+
+        json_client = TestMessage(None)
+        compact_client = TestMessage(None)
+        compact_client.protocol = "compact"
+
+        json_client.broadcast_event([json_client, compact_client], "bob", 
+                {"a": 1}, [1])
+
+        self.assertEquals([
+            ([json_client], '{"message": {"a": 1}, "type": "event", "name": "bob"}'),
+            ([compact_client], '["bob", [1]]')], sent)
+
+
+class TestOutbox(TestCase):
+
+    def create_connection(self, pending=0):
+        sent = []
+
+        class TestMessage(EventSocketConnection):
+            superseded_events = {"state": frozenset(["state", "delta"])}
+
+            def send(self, message):
+                sent.append(message)
+
+            def close(self):
+                self.closed = True
+
+        session = MagicMock()
+        session.is_closed = False
+        session.send_queue = "x" * pending
+        connection = TestMessage(session)
+        connection.io_loop = MagicMock()
+
+        return connection, sent
+
+    def test_sends_when_not_backed_up(self):
+        connection, sent = self.create_connection()
+
+        connection.send_event("chat", 1)
+
+        self.assertEquals(1, len(sent))
+        self.assertEquals([], connection.outbox)
+
+    def test_queues_when_backed_up(self):
+        connection, sent = self.create_connection(config.OUTBOX_BACKLOG_BYTES)
+
+        connection.send_event("chat", 1)
+        connection.send_event("chat", 2)
+
+        self.assertEquals([], sent)
+        self.assertEquals(["chat", "chat"], 
+                [name for name, data in connection.outbox])
+        self.assertEquals(1, connection.io_loop.add_timeout.call_count)
+
+    def test_superseded_events_coalesced(self):
+        connection, sent = self.create_connection(config.OUTBOX_BACKLOG_BYTES)
+
+        connection.send_event("state", 1)
+        connection.send_event("chat", 1)
+        connection.send_event("delta", 2)
+        connection.send_event("state", 3)
+
+        self.assertEquals([("chat", 1), ("state", 3)], 
+                [(name, json.loads(data)["message"]) 
+                    for name, data in connection.outbox])
+
+    def test_drain(self):
+        connection, sent = self.create_connection(config.OUTBOX_BACKLOG_BYTES)
+        connection.send_event("chat", 1)
+        connection.send_event("chat", 2)
+
+        connection.session.send_queue = ""
+        connection.drain_outbox()
+
+        self.assertEquals([1, 2], [json.loads(data)["message"] for data in sent])
+        self.assertEquals([], connection.outbox)
+
+    def test_drain_still_backed_up(self):
+        connection, sent = self.create_connection(config.OUTBOX_BACKLOG_BYTES)
+        connection.send_event("chat", 1)
+
+        connection.drain_outbox()
+
+        self.assertEquals([], sent)
+        self.assertEquals(2, connection.io_loop.add_timeout.call_count)
+
+    def test_slow_connection_closed(self):
+        connection, sent = self.create_connection(config.OUTBOX_BACKLOG_BYTES)
+
+        for i in range(config.OUTBOX_LIMIT + 1):
+            connection.send_event("chat", i)
+
+        self.assertTrue(connection.closed)
+        self.assertEquals([], connection.outbox)
+
+    def test_slow_connection_drops_oldest(self):
+        connection, sent = self.create_connection(config.OUTBOX_BACKLOG_BYTES)
+        original = config.OUTBOX_DISCONNECT_SLOW
+        config.OUTBOX_DISCONNECT_SLOW = False
+        try:
+            for i in range(config.OUTBOX_LIMIT + 1):
+                connection.send_event("chat", i)
+        finally:
+            config.OUTBOX_DISCONNECT_SLOW = original
+
+        self.assertEquals(config.OUTBOX_LIMIT, len(connection.outbox))
+        self.assertEquals(1, json.loads(connection.outbox[0][1])["message"])
+
+    def test_broadcast_queues_for_backed_up(self):
+        connection, sent = self.create_connection()
+        slow, slow_sent = self.create_connection(config.OUTBOX_BACKLOG_BYTES)
+        connection.broadcast = MagicMock()
+
+        connection.broadcast_event([connection, slow], "chat", 1)
+
+        args, kargs = connection.broadcast.call_args
+        self.assertEquals([connection], args[0])
+        self.assertEquals(["chat"], [name for name, data in slow.outbox])
+
+
+class TestBatching(TestCase):
+
+    def create_connection(self, protocol="json"):
+        sent = []
+
+        class TestMessage(EventSocketConnection):
+            superseded_events = {"state": frozenset(["state"])}
+
+            def send(self, message):
+                sent.append(message)
+
+        session = MagicMock()
+        session.is_closed = False
+        session.send_queue = ""
+        connection = TestMessage(session)
+        connection.io_loop = MagicMock()
+        connection.protocol = protocol
+        connection.batching = True
+
+        return connection, sent
+
+    def test_select_batching(self):
+        connection, sent = self.create_connection()
+        connection.batching = False
+
+        connection.on_message('{"name":"connection:batch", "message":true}')
+
+        self.assertTrue(connection.batching)
+        connection.io_loop.add_callback.assert_called_once_with(
+                connection.flush_batch)
+
+    def test_one_frame_per_tick(self):
+        connection, sent = self.create_connection()
+
+        connection.send_event("a", 1)
+        connection.send_event("b", 2)
+        self.assertEquals([], sent)
+        self.assertEquals(1, connection.io_loop.add_callback.call_count)
+
+        connection.flush_batch()
+
+        self.assertEquals(1, len(sent))
+        frame = json.loads(sent[0])
+        self.assertEquals("batch", frame["type"])
+        self.assertEquals([("a", 1), ("b", 2)], 
+                [(e["name"], e["message"]) for e in frame["events"]])
+
+    def test_single_event_not_wrapped(self):
+        connection, sent = self.create_connection()
+
+        connection.send_event("a", 1)
+        connection.flush_batch()
+
+        self.assertEquals("a", json.loads(sent[0])["name"])
+
+    def test_compact_batch(self):
+        connection, sent = self.create_connection("compact")
+
+        connection.send_event("a", 1)
+        connection.send_event("b", [2])
+        connection.flush_batch()
+
+        self.assertEquals([["a", 1], ["b", [2]]], json.loads(sent[0]))
+
+    def test_superseded_in_batch(self):
+        connection, sent = self.create_connection("compact")
+
+        connection.send_event("state", 1)
+        connection.send_event("a", 1)
+        connection.send_event("state", 2)
+        connection.flush_batch()
+
+        self.assertEquals([["a", 1], ["state", 2]], json.loads(sent[0]))
+
+    def test_broadcast_joins_batch(self):
+        connection, sent = self.create_connection()
+        connection.broadcast = MagicMock()
+
+        connection.send_event("a", 1)
+        connection.broadcast_event([connection], "b", 2)
+        connection.flush_batch()
+
+        self.assertFalse(connection.broadcast.called)
+        self.assertEquals(1, len(sent))
+
+
+class TestSchema(TestCase):
+
+    def test_none_accepts_anything(self):
+        validate = compile_schema(None)
+
+        self.assertEquals({"a": 1}, validate({"a": 1}))
+
+    def test_type(self):
+        validate = compile_schema(basestring)
+
+        self.assertEquals(u"bob", validate(u"bob"))
+        self.assertRaises(MessageError, validate, 1)
+
+    def test_bool_not_int(self):
+        self.assertRaises(MessageError, compile_schema(int), True)
+        self.assertEquals(True, compile_schema((bool, int))(True))
+
+    def test_dict(self):
+        validate = compile_schema({"rank": int, "suit": Optional(int)})
+
+        self.assertEquals({"rank": 1}, validate({"rank": 1, "other": 2}))
+        self.assertRaises(MessageError, validate, {"suit": 1})
+        self.assertRaises(MessageError, validate, {"rank": "1"})
+        self.assertRaises(MessageError, validate, [1])
+
+    def test_list(self):
+        validate = compile_schema([int])
+
+        self.assertEquals([1, 2], validate([1, 2]))
+        self.assertRaises(MessageError, validate, [1, "2"])
+
+    def test_converter(self):
+        validate = compile_schema(lambda value: value["a"] * 2)
+
+        self.assertEquals(4, validate({"a": 2}))
+        self.assertRaises(MessageError, validate, {})
+        self.assertRaises(MessageError, validate, None)
+
+
+class TestValidation(TestCase):
+
+    def create_connection(self):
+        called = []
+
+        class TestMessage(EventSocketConnection):
+
+            @event("test", schema={"value": int})
+            def test(self, room, message):
+                called.append((room, message))
+
+        return TestMessage(None), called
+
+    def test_validators_compiled(self):
+        connection, called = self.create_connection()
+
+        self.assertTrue("test" in connection._validators)
+        self.assertTrue("connection:protocol" in connection._validators)
+
+    def test_valid_message_converted(self):
+        connection, called = self.create_connection()
+
+        connection.on_message('{"name": "test", "room": "r", '
+                '"message": {"value": 1, "extra": 2}}')
+
+        self.assertEquals([("r", {"value": 1})], called)
+
+    def test_invalid_messages_rejected(self):
+        connection, called = self.create_connection()
+
+        for message in ['{"name": "test", "message": {"value": "1"}}',
+                '{"name": "test"}',
+                '{"name": "test", "room": [], "message": {"value": 1}}',
+                '{"name": ["test"]}',
+                '["test"]',
+                '{"message": 1}',
+                'not json']:
+            connection.on_message(message)
+
+        self.assertEquals([], called)
+
+
+def immediate_io_loop():
+    """IOLoop mock that runs future callbacks as soon as they resolve"""
+    io_loop = MagicMock()
+    io_loop.add_future.side_effect = \
+            lambda future, callback: future.add_done_callback(callback)
+    return io_loop
+
+
+class TestSerialExecutor(TestCase):
+
+    def test_plain_calls_run_straight_away(self):
+        executor = SerialExecutor(immediate_io_loop())
+
+        future = executor.submit(lambda a, b: a + b, 1, 2)
+
+        self.assertEquals(3, future.result())
+        self.assertFalse(executor.running)
+
+    def test_future_holds_later_calls(self):
+        executor = SerialExecutor(immediate_io_loop())
+        called = []
+        pending = Future()
+
+        executor.submit(lambda: pending)
+        later = executor.submit(called.append, "later")
+        self.assertEquals([], called)
+        self.assertFalse(later.done())
+
+        pending.set_result(None)
+
+        self.assertEquals(["later"], called)
+        self.assertTrue(later.done())
+
+    def test_error_does_not_stop_queue(self):
+        executor = SerialExecutor(immediate_io_loop())
+        called = []
+
+        failed = executor.submit(lambda: 1 / 0)
+        executor.submit(called.append, "next")
+
+        self.assertRaises(ZeroDivisionError, failed.result)
+        self.assertEquals(["next"], called)
+
+    def test_on_idle(self):
+        idle = []
+        executor = SerialExecutor(immediate_io_loop(), idle.append)
+        pending = Future()
+
+        executor.submit(lambda: pending)
+        self.assertEquals([], idle)
+
+        pending.set_result(None)
+        self.assertEquals([executor], idle)
+
+
+class TestCoroutineHandlers(TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop()
+        self.io_loop.make_current()
+        self.addCleanup(self.io_loop.close)
+        self.addCleanup(IOLoop.clear_current)
+
+        self.called = []
+        self.waits = {"slow": Future()}
+        called = self.called
+        waits = self.waits
+
+        class TestMessage(EventSocketConnection):
+            room_executors = {}
+
+            @event("test")
+            @gen.coroutine
+            def test(self, room, message):
+                called.append((room, message, "start"))
+                if message in waits:
+                    yield waits[message]
+                called.append((room, message, "end"))
+
+        self.connection_class = TestMessage
+
+    def create_connection(self):
+        connection = self.connection_class(None)
+        connection.io_loop = self.io_loop
+        return connection
+
+    def send(self, connection, room, message):
+        return connection.on_message(json.dumps({"name": "test", 
+            "room": room, "message": message}))
+
+    def test_room_events_run_in_order(self):
+        first = self.create_connection()
+        second = self.create_connection()
+
+        self.send(first, "a", "slow")
+        done = self.send(second, "a", "fast")
+        self.assertEquals([("a", "slow", "start")], self.called)
+
+        self.waits["slow"].set_result(None)
+        self.io_loop.run_sync(lambda: done)
+
+        self.assertEquals([("a", "slow", "start"), ("a", "slow", "end"),
+            ("a", "fast", "start"), ("a", "fast", "end")], self.called)
+        self.assertEquals({}, self.connection_class.room_executors)
+
+    def test_rooms_run_concurrently(self):
+        connection = self.create_connection()
+
+        slow = self.send(connection, "a", "slow")
+        self.send(connection, "b", "fast")
+
+        self.assertEquals([("a", "slow", "start"), ("b", "fast", "start"), 
+            ("b", "fast", "end")], self.called)
+        self.assertEquals(["a"], self.connection_class.room_executors.keys())
 
+        self.waits["slow"].set_result(None)
+        self.io_loop.run_sync(lambda: slow)
 
+        self.assertEquals(("a", "slow", "end"), self.called[-1])
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock
+from unittest2 import TestCase, main, skip
+
+from bobswitch import models
+from bobswitch import bobswitch
+from bobswitch import store
+
+def create_test_room():
+    room = bobswitch.Room("room")
+    for name in ("bob", "scott"):
+        room.players[name] = bobswitch.RoomPlayer(name, None, 
+                models.Player(name))
+
+    room.active_players = room.players.copy()
+    room.active_game = bobswitch.create_game(
+            [p.player for p in room.players.values()], 1234)
+
+    return room
+
+class TestEncodeRoom(TestCase):
+
+    def test_round_trip(self):
+        room = create_test_room()
+        room.players["bob"].ready = True
+
+        record = store.decode_room(store.encode_room(room))
+
+        self.assertEquals(["bob", "scott"], 
+                sorted(name for name, player, ready in record["players"]))
+        self.assertTrue(("bob", True) in 
+                [(name, ready) for name, player, ready in record["players"]])
+        self.assertEquals(["bob", "scott"], sorted(record["active_players"]))
+        self.assertEquals(room.active_game.player_hand("bob").cards,
+                record["game"].player_hand("bob").cards)
+
+    def test_no_game(self):
+        room = bobswitch.Room("room")
+        room.players["bob"] = bobswitch.RoomPlayer("bob", None, 
+                models.Player("bob"))
+
+        record = store.decode_room(store.encode_room(room))
+
+        self.assertEquals(None, record["game"])
+        self.assertEquals([], record["active_players"])
+
+
+class TestMemoryRoomStore(TestCase):
+
+    def test_save_load_delete(self):
+        room_store = store.MemoryRoomStore()
+
+        room_store.save_room("room", create_test_room())
+        self.assertEquals(["room"], room_store.load_rooms().keys())
+
+        room_store.delete_room("room")
+        self.assertEquals({}, room_store.load_rooms())
+
+
+class TestSqliteRoomStore(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "rooms.db")
+        #cleanups run last first, so this runs after the stores are closed
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_survives_reopen(self):
+        room_store = store.SqliteRoomStore(self.path, None)
+        room_store.save_room("room", create_test_room())
+        room_store.save_room("other", create_test_room())
+        room_store.delete_room("other")
+        room_store.close()
+
+        room_store = store.SqliteRoomStore(self.path, None)
+        rooms = room_store.load_rooms()
+        room_store.close()
+
+        self.assertEquals(["room"], rooms.keys())
+        record = store.decode_room(rooms["room"])
+        self.assertEquals(1234, record["game"].seed)
+
+    def test_changes_batched(self):
+        io_loop = MagicMock()
+        room_store = store.SqliteRoomStore(self.path, 0.5, io_loop)
+        self.addCleanup(room_store.close)
+        batches = room_store.batches
+        room_store.batches = MagicMock()
+        self.addCleanup(setattr, room_store, "batches", batches)
+
+        room_store.save_room("room", create_test_room())
+        room_store.save_room("room", create_test_room())
+        room_store.save_room("other", create_test_room())
+
+        self.assertEquals(1, io_loop.add_timeout.call_count)
+        self.assertFalse(room_store.batches.put.called)
+
+        room_store.flush()
+
+        args, kargs = room_store.batches.put.call_args
+        self.assertEquals(["other", "room"], sorted(args[0].keys()))
+        self.assertEquals({}, room_store.pending)
+
+    def test_encoded_on_flush(self):
+        room_store = store.SqliteRoomStore(self.path, 0.5, MagicMock())
+        self.addCleanup(room_store.close)
+        batches = room_store.batches
+        room_store.batches = MagicMock()
+        self.addCleanup(setattr, room_store, "batches", batches)
+
+        room = create_test_room()
+        room_store.save_room("room", room)
+        room.players["bob"].ready = True
+        room_store.save_room("gone", create_test_room())
+        room_store.delete_room("gone")
+
+        room_store.flush()
+
+        args, kargs = room_store.batches.put.call_args
+        self.assertEquals(None, args[0]["gone"])
+        record = store.decode_room(args[0]["room"])
+        self.assertTrue(("bob", True) in 
+                [(name, ready) for name, player, ready in record["players"]])